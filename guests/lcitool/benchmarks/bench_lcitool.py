@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+# bench_lcitool - benchmark lcitool's resolution and formatting code
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# Measures loading the inventory and the projects, building the varmap
+# for every host both natively and for each supported cross arch, and
+# generating Dockerfiles and variables for every host. Run it as
+#
+#   $ python3 benchmarks/bench_lcitool.py -o lcitool.json
+#
+# Passing '--scale 10' or '--scale 100' runs the same benchmarks against
+# a synthetic ansible/ tree where the mappings, the projects and the
+# hosts have all been replicated that many times, which shows how the
+# code copes as they keep growing. The synthetic tree is generated under
+# $XDG_CACHE_HOME/lcitool/benchmarks the first time it's needed; at the
+# largest scale, expect a full run to take a while.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pyperf
+import yaml
+
+sys.path.insert(0, Path(__file__).parents[1].as_posix())
+
+from lcitool import cache, util  # noqa: E402
+from lcitool.formatters import DockerfileFormatter  # noqa: E402
+from lcitool.formatters import VariablesFormatter  # noqa: E402
+from lcitool.inventory import Inventory  # noqa: E402
+from lcitool.projects import Projects  # noqa: E402
+from lcitool.resolver import PackageResolver  # noqa: E402
+
+
+def dump_yaml(data, path):
+    with open(path, "w") as fp:
+        yaml.safe_dump(data, fp, default_flow_style=False)
+
+
+def generate_tree(scale):
+    """
+    Generates an ansible/ tree where mappings, projects and hosts have
+    all been replicated 'scale' times, and returns the directory it's
+    been generated in. Copies have the same contents as the original,
+    and their names end in '-sN'.
+    """
+
+    tree = Path(cache.get_cache_dir(), "benchmarks", "scale-{}".format(scale))
+    if tree.exists():
+        return tree
+
+    source = Path(util.get_base(), "ansible")
+    suffixes = [""] + ["-s{}".format(i) for i in range(1, scale)]
+
+    tree.parent.mkdir(parents=True, exist_ok=True)
+    tmpdir = Path(tempfile.mkdtemp(dir=tree.parent))
+    ansible = Path(tmpdir, "ansible")
+    ansible.mkdir()
+
+    shutil.copy(Path(source, "ansible.cfg"), ansible)
+    shutil.copytree(Path(source, "group_vars"), Path(ansible, "group_vars"))
+
+    hosts = []
+    with open(Path(source, "inventory"), "r") as infile:
+        for line in infile:
+            hosts.append(line.strip())
+
+    with open(Path(ansible, "inventory"), "w") as outfile:
+        for host in hosts:
+            for suffix in suffixes:
+                outfile.write(host + suffix + "\n")
+                shutil.copytree(Path(source, "host_vars", host),
+                                Path(ansible, "host_vars", host + suffix))
+
+    mappings = util.yaml_load(
+        Path(source, "vars", "mappings.yml").read_bytes())
+    for key in ["mappings", "pypi_mappings", "cpan_mappings"]:
+        for package, mapping in list(mappings[key].items()):
+            for suffix in suffixes[1:]:
+                mappings[key][package + suffix] = mapping
+    Path(ansible, "vars", "projects").mkdir(parents=True)
+    dump_yaml(mappings, Path(ansible, "vars", "mappings.yml"))
+
+    for path in Path(source, "vars", "projects").glob("*.yml"):
+        packages = util.yaml_load(path.read_bytes())["packages"]
+        for suffix in suffixes:
+            # Internal projects are referred to by name, so they can't
+            # be renamed; they get all the copies of their packages
+            if path.stem in ["base", "unwanted", "cloud-init"]:
+                if suffix:
+                    continue
+                project_packages = [p + s for p in packages for s in suffixes]
+            else:
+                project_packages = [p + suffix for p in packages]
+            dump_yaml({"packages": project_packages},
+                      Path(ansible, "vars", "projects",
+                           path.stem + suffix + ".yml"))
+
+    try:
+        os.replace(tmpdir, tree)
+    except OSError:
+        # Someone else generated the same tree in the meantime
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return tree
+
+
+def get_args(host, projects, cross_arch=None):
+    return argparse.Namespace(
+        hosts=host,
+        projects=projects,
+        cross_arch=cross_arch,
+        buildkit=False,
+        fingerprint=False,
+        format="shell",
+    )
+
+
+def load_inventory(loops, base):
+    t0 = pyperf.perf_counter()
+    for _ in range(loops):
+        inventory = Inventory(base)
+        for host in inventory.expand_pattern("all"):
+            inventory.get_facts(host)
+    return pyperf.perf_counter() - t0
+
+
+def load_projects(loops, base):
+    t0 = pyperf.perf_counter()
+    for _ in range(loops):
+        projects = Projects(base)
+        projects.get_mappings()
+        for project in projects.expand_pattern("all"):
+            projects.get_packages(project)
+    return pyperf.perf_counter() - t0
+
+
+def build_varmaps(loops, base, combinations):
+    inventory = Inventory(base)
+    projects = Projects(base)
+
+    # Only the original projects are selected, otherwise the cost for
+    # each host would grow with the scale too
+    selected_projects = Projects().expand_pattern("all")
+
+    t0 = pyperf.perf_counter()
+    for _ in range(loops):
+        # A fresh resolver every time, like a single lcitool run would
+        formatter = VariablesFormatter(projects, inventory,
+                                       PackageResolver(projects))
+        for host, cross_arch in combinations:
+            formatter._generator_build_varmap(inventory.get_facts(host),
+                                              selected_projects,
+                                              cross_arch)
+    return pyperf.perf_counter() - t0
+
+
+def format_all(loops, base, formatter_class, hosts):
+    inventory = Inventory(base)
+    projects = Projects(base)
+
+    t0 = pyperf.perf_counter()
+    for _ in range(loops):
+        formatter = formatter_class(projects, inventory,
+                                    PackageResolver(projects))
+        for host in hosts:
+            formatter.format(get_args(host, "libvirt"))
+    return pyperf.perf_counter() - t0
+
+
+def add_cmdline_args(cmd, args):
+    # Worker processes need to know about our own options too
+    cmd.extend(["--scale", str(args.scale)])
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=add_cmdline_args)
+    runner.argparser.add_argument("--scale", type=int, default=1,
+                                  help="replicate mappings, projects and "
+                                       "hosts this many times")
+    runner.argparser.set_defaults(inherit_environ=["XDG_CACHE_HOME"])
+    runner.metadata["description"] = "lcitool resolution benchmark"
+
+    args = runner.parse_args()
+    if args.scale > 1:
+        base = generate_tree(args.scale)
+    else:
+        base = util.get_base()
+    runner.metadata["lcitool_scale"] = args.scale
+
+    # Figure out which combinations are supported upfront
+    inventory = Inventory(base)
+    projects = Projects(base)
+    validator = VariablesFormatter(projects, inventory)
+
+    hosts = inventory.expand_pattern("all")
+    native = [(host, None) for host in hosts]
+    cross = []
+    for host in hosts:
+        facts = inventory.get_facts(host)
+        for cross_arch in util.get_arches():
+            if validator._generator_get_unsupported(host, facts,
+                                                    cross_arch) is not None:
+                continue
+            cross.append((host, cross_arch))
+
+    linux_hosts = []
+    for host in hosts:
+        if inventory.get_facts(host)["packaging"]["format"] in ["deb", "rpm"]:
+            linux_hosts.append(host)
+
+    suffix = "-x{}".format(args.scale)
+    runner.bench_time_func("inventory-load" + suffix, load_inventory, base)
+    runner.bench_time_func("projects-load" + suffix, load_projects, base)
+    runner.bench_time_func("build-varmap-native" + suffix,
+                           build_varmaps, base, native)
+    runner.bench_time_func("build-varmap-cross" + suffix,
+                           build_varmaps, base, cross)
+    runner.bench_time_func("format-dockerfile" + suffix,
+                           format_all, base, DockerfileFormatter, linux_hosts)
+    runner.bench_time_func("format-variables" + suffix,
+                           format_all, base, VariablesFormatter, hosts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# bench_startup - benchmark lcitool's startup time
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# Measures how long it takes to run a few quick lcitool commands from
+# start to finish, along with the time it takes the interpreter to start
+# up and do nothing, which is the lower bound for all of them. Listing
+# commands should stay within 100 ms of that. Run it as
+#
+#   $ python3 benchmarks/bench_startup.py -o startup.json
+#
+# and look for the modules responsible for any regression with
+#
+#   $ python3 -X importtime bin/lcitool hosts 2>&1 >/dev/null | sort -t'|' -k2 -n
+
+import os
+import sys
+from pathlib import Path
+
+import pyperf
+
+sys.path.insert(0, Path(__file__).parents[1].as_posix())
+
+from lcitool import util  # noqa: E402
+
+
+def main():
+    base = util.get_base()
+
+    # The commands run by pyperf's workers need to be able to find the
+    # lcitool module, and should use the same cache as everything else
+    os.environ["PYTHONPATH"] = base
+    runner = pyperf.Runner()
+    runner.argparser.set_defaults(inherit_environ=["PYTHONPATH",
+                                                   "XDG_CACHE_HOME"])
+    runner.metadata["description"] = "lcitool startup benchmark"
+
+    lcitool = Path(base, "bin", "lcitool").as_posix()
+    commands = {
+        "python": ["-c", "pass"],
+        "hosts": [lcitool, "hosts"],
+        "projects": [lcitool, "projects"],
+        "variables": [lcitool, "variables", "libvirt-fedora-32", "libvirt"],
+    }
+
+    for name, args in commands.items():
+        runner.bench_command("startup-{}".format(name),
+                             [sys.executable] + args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# bench_yaml - benchmark the YAML loaders available to lcitool
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# Measures how long it takes to parse vars/mappings.yml and the whole
+# ansible/ tree with the pure Python loader and, if PyYAML was built
+# against libyaml, with the C loader. Run it as
+#
+#   $ python3 benchmarks/bench_yaml.py -o yaml.json
+#
+# and compare results across machines with 'python3 -m pyperf compare_to'.
+
+import sys
+from pathlib import Path
+
+import pyperf
+import yaml
+
+sys.path.insert(0, Path(__file__).parents[1].as_posix())
+
+from lcitool import util  # noqa: E402
+
+
+def get_loaders():
+    loaders = {"python": yaml.SafeLoader}
+    if yaml.__with_libyaml__:
+        loaders["libyaml"] = yaml.CSafeLoader
+    return loaders
+
+
+def read_files(paths):
+    contents = []
+    for path in paths:
+        with open(path, "rb") as infile:
+            contents.append(infile.read())
+    return contents
+
+
+def load_all(loops, contents, loader):
+    t0 = pyperf.perf_counter()
+    for _ in range(loops):
+        for content in contents:
+            yaml.load(content, Loader=loader)
+    return pyperf.perf_counter() - t0
+
+
+def main():
+    runner = pyperf.Runner()
+    runner.metadata["description"] = "lcitool YAML loading benchmark"
+
+    base = Path(util.get_base(), "ansible")
+    datasets = {
+        "mappings": [Path(base, "vars", "mappings.yml")],
+        "ansible-tree": sorted(base.glob("**/*.yml")),
+    }
+
+    for dataset, paths in datasets.items():
+        # Files are read upfront so that only parsing is measured
+        contents = read_files(paths)
+
+        for name, loader in get_loaders().items():
+            runner.bench_time_func("yaml-{}-{}".format(dataset, name),
+                                   load_all, contents, loader)
+
+
+if __name__ == "__main__":
+    main()
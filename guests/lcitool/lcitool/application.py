@@ -4,36 +4,212 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-import json
-import os
-import subprocess
-import distutils.spawn
-import tempfile
+import sys
 from pathlib import Path
 
-from lcitool import util
-from lcitool.config import Config
-from lcitool.inventory import Inventory
-from lcitool.projects import Projects
-from lcitool.formatters import DockerfileFormatter, VariablesFormatter
+from lcitool import timings, util
+
+# Modules which are expensive to import and only needed by some actions
+# are imported by the methods using them, so that the others start fast
 
 
 class Application:
 
     def __init__(self):
-        self._config = Config()
-        self._inventory = Inventory()
-        self._projects = Projects()
+        # Objects are only created the first time they're needed, so that
+        # simple commands don't pay for what they don't use
+        self.__config = None
+        self.__inventory = None
+        self.__projects = None
+        self.__resolver = None
+
+    @property
+    def _config(self):
+        if self.__config is None:
+            from lcitool.config import Config
+
+            with timings.phase("config load", "config"):
+                self.__config = Config()
+        return self.__config
+
+    @property
+    def _inventory(self):
+        if self.__inventory is None:
+            from lcitool.inventory import Inventory
+
+            with timings.phase("inventory load", "inventory"):
+                self.__inventory = Inventory()
+        return self.__inventory
+
+    @property
+    def _projects(self):
+        if self.__projects is None:
+            from lcitool.projects import Projects
+
+            with timings.phase("projects load", "projects"):
+                self.__projects = Projects()
+        return self.__projects
+
+    @property
+    def _resolver(self):
+        if self.__resolver is None:
+            from lcitool.resolver import PackageResolver
+
+            self.__resolver = PackageResolver(self._projects)
+        return self.__resolver
+
+    def _resolve_packages(self, hosts, selected_projects):
+        # Mappings are resolved here rather than in the playbook: doing so
+        # in Python once is much faster than doing it in Jinja for every
+        # single host. The playbook also needs the internal projects
+        arch = self._config.values["install"]["arch"]
+        projects = ["base", "unwanted", "cloud-init"] + selected_projects
+
+        resolved = {}
+        for host in hosts:
+            facts = self._inventory.get_facts(host)
+
+            resolved[host] = {}
+            for project in projects:
+                pkgs, pypi_pkgs, cpan_pkgs = self._resolver.resolve_project(
+                    facts,
+                    project,
+                    arch,
+                )
+                resolved[host][project] = {
+                    "native": sorted(set(pkgs.values())),
+                    "pypi": sorted(set(pypi_pkgs.values())),
+                    "cpan": sorted(set(cpan_pkgs.values())),
+                }
+
+        return resolved
+
+    @staticmethod
+    def _get_git_commit(git_url, git_branch):
+        import subprocess
 
-        self._native_arch = util.get_native_arch()
+        if git_url is None:
+            return None
+
+        # git ls-remote matches refs by their trailing components, so
+        # looking for 'master' would also find 'refs/heads/foo/master'
+        # and 'refs/tags/master': ask for the branch explicitly, and only
+        # accept an exact match
+        ref = "refs/heads/" + git_branch
+
+        try:
+            with timings.phase("git ls-remote " + git_url, "subprocess"):
+                output = subprocess.check_output(
+                    ["git", "ls-remote", git_url, ref],
+                    stderr=subprocess.DEVNULL,
+                    universal_newlines=True,
+                    timeout=60,
+                )
+        except Exception:
+            return None
+
+        commits = [line.split()[0] for line in output.splitlines()
+                   if line.split()[1:] == [ref]]
+        if len(commits) != 1:
+            raise Exception(
+                "Branch '{}' not found in {}".format(git_branch, git_url))
+        return commits[0]
+
+    def _get_build_inputs(self, hosts, selected_projects, git_remote,
+                          git_branch):
+        import concurrent.futures
+
+        from lcitool import cache
+
+        base = Path(util.get_base(), "ansible")
+        playbook_base = Path(base, "playbooks", "build")
+        arch = self._config.values["install"]["arch"]
+
+        defaults = cache.load_yaml(Path(playbook_base, "jobs", "defaults.yml"))
+
+        git_urls = []
+        recipes = {}
+        for project in selected_projects:
+            git_urls.append(
+                defaults["git_urls"].get(project, {}).get(git_remote)
+            )
+
+            # Besides the list of jobs, any change to the way the project
+            # or its jobs are defined warrants a rebuild
+            definition = cache.load_yaml(Path(playbook_base, "projects",
+                                              project + ".yml"))
+            jobs = []
+            job_definitions = []
+            for task in definition:
+                if "include" not in task:
+                    continue
+                job = Path(task["include"]).stem
+                job_definitions.append(cache.load_yaml(
+                    Path(playbook_base, "jobs", job + ".yml")
+                ))
+                if job != "prepare":
+                    jobs.append(job)
+
+            recipes[project] = {
+                "jobs": jobs,
+                "recipe": util.get_digest([definition, job_definitions]),
+            }
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            commits = dict(zip(selected_projects,
+                               executor.map(self._get_git_commit, git_urls,
+                                            [git_branch] * len(git_urls))))
+
+        inputs = {}
+        for host in hosts:
+            facts = self._inventory.get_facts(host)
+
+            inputs[host] = {}
+            for project in selected_projects:
+                packages = []
+                for p in ["base", project]:
+                    pkgs, pypi_pkgs, cpan_pkgs = self._resolver.resolve_project(
+                        facts,
+                        p,
+                        arch,
+                    )
+                    packages.extend([
+                        sorted(set(pkgs.values())),
+                        sorted(set(pypi_pkgs.values())),
+                        sorted(set(cpan_pkgs.values())),
+                    ])
+
+                inputs[host][project] = {
+                    "git_remote": git_remote,
+                    "git_branch": git_branch,
+                    "commit": commits[project],
+                    "packages": util.get_digest(packages),
+                }
+                inputs[host][project].update(recipes[project])
+
+        return inputs
+
+    def _execute_playbook(self, playbook, hosts, projects, git_revision,
+                          forks, shards, force=False):
+        import json
+        import os
+        import shutil
+        import subprocess
+        import tempfile
+
+        from lcitool.buildstate import BuildState
 
-    def _execute_playbook(self, playbook, hosts, projects, git_revision):
         base = Path(util.get_base(), "ansible").as_posix()
         config = self._config
 
         config.validate_vm_settings()
 
-        ansible_hosts = ",".join(self._inventory.expand_pattern(hosts))
+        if shards < 1:
+            raise Exception("Invalid number of shards '{}'".format(shards))
+        if forks is not None and forks < 1:
+            raise Exception("Invalid number of forks '{}'".format(forks))
+
+        ansible_hosts = self._inventory.expand_pattern(hosts)
         selected_projects = self._projects.expand_pattern(projects)
 
         if git_revision is not None:
@@ -48,6 +224,41 @@ class Application:
             git_remote = "default"
             git_branch = "master"
 
+        build_state = None
+        if playbook == "build":
+            build_state = BuildState()
+            build_inputs = self._get_build_inputs(ansible_hosts,
+                                                  selected_projects,
+                                                  git_remote,
+                                                  git_branch)
+
+            build_skip = {}
+            for host in ansible_hosts:
+                build_skip[host] = []
+                if force:
+                    continue
+
+                # Projects are built in order and each one is installed
+                # for the ones that come after it to use, so once we have
+                # to rebuild a project we can't skip any of the following
+                # ones: they might be built against it
+                for project in selected_projects:
+                    inputs = build_inputs[host][project]
+                    if not build_state.is_current(host, project, inputs):
+                        break
+                    build_skip[host].append(project)
+
+                if build_skip[host]:
+                    print("{}: skipping up to date projects: {}".format(
+                        host, ", ".join(build_skip[host])))
+
+            # Hosts with nothing left to build don't need to be contacted
+            ansible_hosts = [h for h in ansible_hosts
+                             if len(build_skip[h]) < len(selected_projects)]
+            if not ansible_hosts:
+                print("Nothing to build")
+                return
+
         tempdir = tempfile.TemporaryDirectory(prefix="lcitool")
 
         ansible_cfg_path = Path(base, "ansible.cfg").as_posix()
@@ -64,19 +275,47 @@ class Application:
             "git_branch": git_branch,
         })
 
+        if playbook == "update":
+            extra_vars["resolved_packages"] = self._resolve_packages(
+                ansible_hosts,
+                selected_projects,
+            )
+
+        if build_state is not None:
+            # The playbook leaves a marker in here for every project it
+            # has built successfully on a host
+            build_results_dir = Path(tempdir.name, "results")
+            for host in ansible_hosts:
+                Path(build_results_dir, host).mkdir(parents=True)
+
+            # Incremental builds need to know when the packages a project
+            # depends on have changed
+            build_deps = {}
+            for host in ansible_hosts:
+                build_deps[host] = {}
+                for project in selected_projects:
+                    inputs = build_inputs[host][project]
+                    build_deps[host][project] = inputs["packages"]
+
+            extra_vars["build_skip"] = build_skip
+            extra_vars["build_deps"] = build_deps
+            extra_vars["build_results_dir"] = build_results_dir.as_posix()
+
         with open(extra_vars_path, "w") as fp:
             json.dump(extra_vars, fp)
 
-        ansible_playbook = distutils.spawn.find_executable("ansible-playbook")
+        ansible_playbook = shutil.which("ansible-playbook")
         if ansible_playbook is None:
             raise Exception("Cannot find ansible-playbook in $PATH")
 
         cmd = [
             ansible_playbook,
-            "--limit", ansible_hosts,
             "--extra-vars", "@" + extra_vars_path,
         ]
 
+        if forks is not None:
+            cmd.extend(["--forks", str(forks)])
+
         cmd.append(playbook_path)
 
         # We need to point Ansible to the correct configuration file,
@@ -85,13 +324,84 @@ class Application:
         os.environ["ANSIBLE_CONFIG"] = ansible_cfg_path
 
         try:
-            subprocess.check_call(cmd)
-        except Exception as ex:
-            raise Exception(
-                "Failed to run {} on '{}': {}".format(playbook, hosts, ex))
+            if shards == 1:
+                try:
+                    with timings.phase("ansible-playbook " + playbook,
+                                       "subprocess"):
+                        subprocess.check_call(cmd + [
+                            "--limit", ",".join(ansible_hosts),
+                        ])
+                except Exception as ex:
+                    raise Exception(
+                        "Failed to run {} on '{}': {}".format(playbook,
+                                                              hosts, ex))
+            else:
+                self._execute_playbook_shards(playbook, cmd, ansible_hosts,
+                                              shards)
         finally:
+            # Builds that succeeded are recorded even if others failed
+            if build_state is not None:
+                for host in ansible_hosts:
+                    for marker in Path(build_results_dir, host).iterdir():
+                        build_state.update(host, marker.name,
+                                           build_inputs[host][marker.name])
+                build_state.save()
+
             tempdir.cleanup()
 
+    def _execute_playbook_shards(self, playbook, cmd, ansible_hosts, shards):
+        import concurrent.futures
+        import os
+
+        from lcitool import cache, output
+
+        base = Path(util.get_base(), "ansible")
+        log_dir = Path(cache.get_cache_dir(), "logs", playbook)
+
+        # Hosts are distributed round-robin, so that each shard gets a mix
+        # of operating systems rather than all the slow ones ending up in
+        # the same place
+        shards = min(shards, len(ansible_hosts))
+        shard_hosts = [ansible_hosts[i::shards] for i in range(shards)]
+
+        with output.Multiplexer(log_dir) as multiplexer:
+            futures = []
+            for shard in range(shards):
+                # Each ansible-playbook process gets its own log file, so
+                # that they don't end up interleaved
+                env = dict(os.environ)
+                env["ANSIBLE_LOG_PATH"] = Path(
+                    base, "log.{}".format(shard)).as_posix()
+
+                job = multiplexer.job("shard {}".format(shard))
+                future = job.submit(cmd + [
+                    "--limit", ",".join(shard_hosts[shard]),
+                ], env=env)
+                future.add_done_callback(
+                    lambda f, job=job: job.finish(f.exception() is None))
+                futures.append(future)
+
+            concurrent.futures.wait(futures)
+
+        failed = []
+        for shard, future in enumerate(futures):
+            try:
+                future.result()
+                print("shard {}: OK ({})".format(shard,
+                                                 ", ".join(shard_hosts[shard])))
+            except Exception as ex:
+                print("shard {}: FAILED ({}): {}".format(
+                    shard, ", ".join(shard_hosts[shard]), ex))
+                failed.append(shard)
+
+        print("Logs for each shard are in {}".format(log_dir))
+
+        if failed:
+            raise Exception(
+                "Failed to run {} on {} out of {} shards".format(
+                    playbook, len(failed), shards)
+            )
+
     def _action_hosts(self, args):
         for host in self._inventory.expand_pattern("all"):
             print(host)
@@ -100,126 +410,689 @@ class Application:
         for project in self._projects.expand_pattern("all"):
             print(project)
 
-    def _action_install(self, args):
-        base = util.get_base()
-        config = self._config
+    def _prefetch_boot_files(self, hosts):
+        import concurrent.futures
 
-        config.validate_vm_settings()
+        from lcitool import bootcache
+
+        # Local kernels and initrds can only be used through the --install
+        # option, which was introduced in virt-install 3.0
+        version = self._get_virt_install_version()
+        if version is None or version < (3, 0):
+            return {}
+
+        arch = self._config.values["install"]["arch"]
 
-        for host in self._inventory.expand_pattern(args.hosts):
+        # Several hosts can share the same install tree, and there's no
+        # point in downloading its files more than once
+        urls = {}
+        for host in hosts:
             facts = self._inventory.get_facts(host)
+            url = facts.get("install", {}).get("url")
+            if url is not None:
+                urls.setdefault(url, facts["os"]["name"])
 
-            # Both memory size and disk size are stored as GiB in the
-            # inventory, but virt-install expects the disk size in GiB
-            # and the memory size in *MiB*, so perform conversion here
-            memory_arg = str(config.values["install"]["memory_size"] * 1024)
+        if not urls:
+            return {}
 
-            vcpus_arg = str(config.values["install"]["vcpus"])
+        # Downloads are mostly spent waiting for the network, so they're
+        # run concurrently regardless of how many installations are; a
+        # few at a time is enough to make good use of the bandwidth
+        workers = min(len(urls), 4)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {}
+            for url, os_name in urls.items():
+                futures[url] = executor.submit(bootcache.prefetch,
+                                               url, os_name, arch)
 
-            disk_arg = "size={},pool={},bus=virtio".format(
-                config.values["install"]["disk_size"],
-                config.values["install"]["storage_pool"],
-            )
-            network_arg = "network={},model=virtio".format(
-                config.values["install"]["network"],
+        # Not being able to use the cache is not fatal: virt-install will
+        # simply fetch the files from the install tree itself
+        boot_files = {}
+        for url in urls:
+            try:
+                boot_files[url] = futures[url].result()
+            except Exception as ex:
+                print("Failed to prefetch {}: {}".format(url, ex),
+                      file=sys.stderr)
+                boot_files[url] = None
+
+        return boot_files
+
+    def _get_unattended_config(self, host, facts):
+        base = util.get_base()
+
+        # Different operating systems require different configuration
+        # files for unattended installation to work, but some operating
+        # systems simply don't support unattended installation at all
+        if facts["os"]["name"] in ["Debian", "Ubuntu"]:
+            install_config = "preseed.cfg"
+        elif facts["os"]["name"] in ["CentOS", "Fedora"]:
+            install_config = "kickstart.cfg"
+        elif facts["os"]["name"] == "OpenSUSE":
+            install_config = "autoinst.xml"
+        else:
+            raise Exception(
+                "Host {} doesn't support installation".format(host)
             )
 
-            # Different operating systems require different configuration
-            # files for unattended installation to work, but some operating
-            # systems simply don't support unattended installation at all
-            if facts["os"]["name"] in ["Debian", "Ubuntu"]:
-                install_config = "preseed.cfg"
-            elif facts["os"]["name"] in ["CentOS", "Fedora"]:
-                install_config = "kickstart.cfg"
-            elif facts["os"]["name"] == "OpenSUSE":
-                install_config = "autoinst.xml"
-            else:
-                raise Exception(
-                    "Host {} doesn't support installation".format(host)
+        # Unattended install scripts are being generated on the fly, based
+        # on the templates present in guests/configs/
+        unattended_options = {
+            "install.url": facts["install"]["url"],
+        }
+
+        with open(Path(base, "configs", install_config), 'r') as template:
+            content = template.read()
+            for option in unattended_options:
+                content = content.replace(
+                    "{{ " + option + " }}",
+                    unattended_options[option],
                 )
 
-            # Unattended install scripts are being generated on the fly, based
-            # on the templates present in guests/configs/
-            unattended_options = {
-                "install.url": facts["install"]["url"],
-            }
+        return install_config, content
 
-            with open(Path(base, "configs", install_config), 'r') as template:
-                content = template.read()
-                for option in unattended_options:
-                    content = content.replace(
-                        "{{ " + option + " }}",
-                        unattended_options[option],
-                    )
+    def _get_vm_args(self):
+        config = self._config
 
-            tempdir = tempfile.TemporaryDirectory(prefix="lcitool")
-            initrd_inject = Path(tempdir.name, install_config).as_posix()
-
-            with open(initrd_inject, "w") as inject:
-                inject.write(content)
-
-            # preseed files must use a well-known name to be picked up by
-            # d-i; for kickstart files, we can use whatever name we please
-            # but we need to point anaconda in the right direction through
-            # the 'ks' kernel parameter. We can use 'ks' unconditionally
-            # for simplicity's sake, because distributions that don't use
-            # kickstart for unattended installation will simply ignore it.
-            # We do the same with the 'install' argument in order to
-            # workaround a bug which causes old virt-install versions to
-            # not pass the URL correctly when installing openSUSE guests
-            extra_arg = "console=ttyS0 ks=file:/{} install={}".format(
-                install_config,
-                facts["install"]["url"],
-            )
+        # Both memory size and disk size are stored as GiB in the
+        # inventory, but virt-install expects the disk size in GiB
+        # and the memory size in *MiB*, so perform conversion here
+        memory_arg = str(config.values["install"]["memory_size"] * 1024)
+
+        vcpus_arg = str(config.values["install"]["vcpus"])
+
+        network_arg = "network={},model=virtio".format(
+            config.values["install"]["network"],
+        )
+
+        return [
+            "--virt-type", config.values["install"]["virt_type"],
+            "--arch", config.values["install"]["arch"],
+            "--machine", config.values["install"]["machine"],
+            "--cpu", config.values["install"]["cpu_model"],
+            "--vcpus", vcpus_arg,
+            "--memory", memory_arg,
+            "--network", network_arg,
+            "--graphics", "none",
+            "--console", "pty",
+            "--sound", "none",
+            "--rng", "device=/dev/urandom,model=virtio",
+        ]
+
+    def _get_unattended_args(self, host, facts, boot_files, tempdir):
+        install_config, content = self._get_unattended_config(host, facts)
+
+        # preseed files must use a well-known name to be picked up by
+        # d-i; for kickstart files, we can use whatever name we please
+        # but we need to point anaconda in the right direction through
+        # the 'ks' kernel parameter. We can use 'ks' unconditionally
+        # for simplicity's sake, because distributions that don't use
+        # kickstart for unattended installation will simply ignore it.
+        # We do the same with the 'install' argument in order to
+        # workaround a bug which causes old virt-install versions to
+        # not pass the URL correctly when installing openSUSE guests
+        extra_arg = "console=ttyS0 ks=file:/{} install={}".format(
+            install_config,
+            facts["install"]["url"],
+        )
+
+        # Locally cached copies of the kernel and initrd are preferred,
+        # as they don't require downloading anything. virt-install can
+        # only inject files into an initrd it has downloaded itself, so
+        # we have to do that ourselves; kernel arguments have to be passed
+        # as a --install suboption too, and none of them can contain any
+        # comma since that's what suboptions are separated by
+        if boot_files is not None:
+            import shutil
+
+            from lcitool import bootcache
+
+            kernel, initrd = boot_files
+            staged_kernel = Path(tempdir, "kernel").as_posix()
+            injected = Path(tempdir, "initrd").as_posix()
+            suboptions = [staged_kernel, injected, extra_arg]
+
+            if not any(["," in s for s in suboptions]):
+                # Both files are staged along with the initrd, in a
+                # directory qemu can read from
+                shutil.copyfile(kernel, staged_kernel)
+                bootcache.inject(initrd, {install_config: content}, injected)
+
+                return [
+                    "--install",
+                    "kernel={},initrd={},kernel_args={}".format(*suboptions),
+                ]
+
+        initrd_inject = Path(tempdir, install_config).as_posix()
+
+        with open(initrd_inject, "w") as inject:
+            inject.write(content)
+
+        return [
+            "--location", facts["install"]["url"],
+            "--initrd-inject", initrd_inject,
+            "--extra-args", extra_arg,
+        ]
+
+    @staticmethod
+    def _get_install_tempdir(boot_files):
+        import os
+        import tempfile
+
+        # When running as root, guests are usually installed through
+        # qemu:///system, where qemu runs as an unprivileged user which
+        # can't get to the kernel and initrd in our own directories. So
+        # we put them where virt-install stages its own downloads
+        if boot_files is None or os.geteuid() != 0:
+            return tempfile.TemporaryDirectory(prefix="lcitool")
+
+        scratch_dir = Path("/var/lib/libvirt/boot")
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+
+        tempdir = tempfile.TemporaryDirectory(prefix="lcitool",
+                                              dir=scratch_dir)
+        os.chmod(tempdir.name, 0o755)
+        return tempdir
+
+    @staticmethod
+    def _get_virt_install():
+        import shutil
+
+        virt_install = shutil.which("virt-install")
+        if virt_install is None:
+            raise Exception("Cannot find virt-install in $PATH")
+        return virt_install
+
+    def _get_virt_install_version(self):
+        import subprocess
+
+        try:
+            output = subprocess.check_output([self._get_virt_install(),
+                                              "--version"],
+                                             stderr=subprocess.DEVNULL,
+                                             universal_newlines=True)
+            return tuple([int(n) for n in output.strip().split(".")[:2]])
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+
+    def _install_host(self, host, wait, job, boot_files=None):
+        import subprocess
+
+        config = self._config
+
+        facts = self._inventory.get_facts(host)
+
+        disk_arg = "size={},pool={},bus=virtio".format(
+            config.values["install"]["disk_size"],
+            config.values["install"]["storage_pool"],
+        )
 
-            virt_install = distutils.spawn.find_executable("virt-install")
-            if virt_install is None:
-                raise Exception("Cannot find virt-install in $PATH")
+        tempdir = self._get_install_tempdir(boot_files)
 
+        try:
             cmd = [
-                virt_install,
+                self._get_virt_install(),
                 "--name", host,
-                "--location", facts["install"]["url"],
-                "--virt-type", config.values["install"]["virt_type"],
-                "--arch", config.values["install"]["arch"],
-                "--machine", config.values["install"]["machine"],
-                "--cpu", config.values["install"]["cpu_model"],
-                "--vcpus", vcpus_arg,
-                "--memory", memory_arg,
+            ] + self._get_unattended_args(host, facts, boot_files,
+                                          tempdir.name) + [
                 "--disk", disk_arg,
-                "--network", network_arg,
-                "--graphics", "none",
-                "--console", "pty",
-                "--sound", "none",
-                "--rng", "device=/dev/urandom,model=virtio",
-                "--initrd-inject", initrd_inject,
-                "--extra-args", extra_arg,
+            ] + self._get_vm_args()
+        except Exception:
+            tempdir.cleanup()
+            raise
+
+        if job is not None:
+            # The console can't be attached when output is shared with
+            # other installations, but virt-install can still be told
+            # to wait until the installation has completed
+            cmd.append("--noautoconsole")
+            if wait:
+                cmd.extend(["--wait", "-1"])
+        elif not wait:
+            cmd.append("--noautoconsole")
+
+        try:
+            if job is not None:
+                job.run(cmd)
+            else:
+                with timings.phase("virt-install " + host, "subprocess"):
+                    subprocess.check_call(cmd)
+        except Exception as ex:
+            raise Exception("Failed to install '{}': {}".format(host, ex))
+        finally:
+            tempdir.cleanup()
+
+    def _get_golden_digest(self, host, facts):
+        install_config, content = self._get_unattended_config(host, facts)
+
+        # Anything that affects the contents of the golden image: when
+        # any of it changes, a new image is built
+        return util.get_digest({
+            "install_config": install_config,
+            "content": content,
+            "url": facts["install"]["url"],
+            "arch": self._config.values["install"]["arch"],
+            "machine": self._config.values["install"]["machine"],
+            "disk_size": self._config.values["install"]["disk_size"],
+        })
+
+    def _build_golden(self, host, path, job, boot_files=None):
+        import os
+        import subprocess
+
+        from lcitool import golden
+
+        config = self._config
+
+        # Different hosts running the same operating system might need
+        # different golden images, so they're named after the file
+        name = path.stem
+
+        facts = self._inventory.get_facts(host)
+        # The image only gets its final name once it's complete, so that
+        # an interrupted build is never mistaken for a usable image
+        partial = path.with_suffix(".partial")
+        disk_arg = "path={},format=qcow2,size={},bus=virtio".format(
+            partial,
+            config.values["install"]["disk_size"],
+        )
+
+        tempdir = self._get_install_tempdir(boot_files)
+
+        try:
+            cmd = [
+                self._get_virt_install(),
+                "--name", name,
+            ] + self._get_unattended_args(host, facts, boot_files,
+                                          tempdir.name) + [
+                "--disk", disk_arg,
+            ] + self._get_vm_args() + [
+                "--noautoconsole",
+                "--wait", "-1",
+                "--noreboot",
             ]
 
-            if not args.wait:
-                cmd.append("--noautoconsole")
+            if job is not None:
+                job.run(cmd)
+            else:
+                with timings.phase("virt-install " + name, "subprocess"):
+                    subprocess.check_call(cmd)
 
-            try:
-                subprocess.check_call(cmd)
-            except Exception as ex:
-                raise Exception("Failed to install '{}': {}".format(host, ex))
-            finally:
-                tempdir.cleanup()
+            # Only the disk image is needed from now on
+            golden.remove_guest(name, job)
+            golden.generalize(partial, job)
+            os.replace(partial, path)
+        except Exception as ex:
+            # Leave nothing behind that would get in the way of the next
+            # attempt at building the image
+            self._remove_guest_and_disk(name, partial, job)
+            raise Exception(
+                "Failed to build golden image '{}': {}".format(name, ex))
+        finally:
+            tempdir.cleanup()
+
+    def _clone_host(self, host, image, replace, job):
+        import subprocess
+
+        from lcitool import golden
+
+        # Guest disks are created next to the golden image, using the
+        # same name virt-install would have picked for them
+        path = Path(image.parent, host + ".qcow2")
+        created = False
+
+        try:
+            if golden.guest_exists(host):
+                if not replace:
+                    raise Exception("Guest already exists")
+                golden.remove_guest(host, job)
+            elif path.exists() and not replace:
+                raise Exception("Disk image {} already exists".format(path))
+
+            created = True
+            golden.create_overlay(image, path, job)
+            golden.customize(path, host, job)
+
+            cmd = [
+                self._get_virt_install(),
+                "--name", host,
+                "--import",
+                "--disk", "path={},format=qcow2,bus=virtio".format(path),
+            ] + self._get_vm_args() + [
+                "--noautoconsole",
+            ]
+
+            if job is not None:
+                job.run(cmd)
+            else:
+                with timings.phase("virt-install " + host, "subprocess"):
+                    subprocess.check_call(cmd)
+        except Exception as ex:
+            # A half-created guest would prevent cloning it again
+            # without --replace
+            if created:
+                self._remove_guest_and_disk(host, path, job)
+            raise Exception("Failed to clone '{}': {}".format(host, ex))
+
+    @staticmethod
+    def _remove_guest_and_disk(name, path, job):
+        from lcitool import golden
+
+        # This is only used for cleaning up after a failure, which is
+        # what gets reported: errors happening here would only hide it
+        try:
+            if golden.guest_exists(name):
+                golden.remove_guest(name, job)
+        except Exception:
+            pass
+
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _run_install_jobs(jobs, parallel):
+        import concurrent.futures
+
+        from lcitool import cache, output
+
+        if not jobs:
+            return []
+
+        # Failing to install a host doesn't affect the others: we let all
+        # installations run to completion and report on them at the end
+        results = {}
+
+        if parallel == 1:
+            # One installation at a time gets to use the terminal directly,
+            # so that its console can be attached to
+            for name, func in jobs.items():
+                try:
+                    func(None)
+                    results[name] = None
+                except Exception as ex:
+                    results[name] = ex
+        else:
+            log_dir = Path(cache.get_cache_dir(), "logs", "install")
+
+            def run_job(func, job):
+                try:
+                    func(job)
+                except Exception:
+                    job.finish(False)
+                    raise
+                job.finish(True)
+
+            with output.Multiplexer(log_dir) as multiplexer, \
+                 concurrent.futures.ThreadPoolExecutor(parallel) as executor:
+                futures = {}
+                for name, func in jobs.items():
+                    futures[name] = executor.submit(run_job, func,
+                                                    multiplexer.job(name))
+
+            for name in jobs:
+                results[name] = futures[name].exception()
+
+        failed = []
+        for name, ex in results.items():
+            if ex is None:
+                print("{}: OK".format(name))
+            else:
+                print("{}: FAILED ({})".format(name, ex))
+                failed.append(name)
+
+        if parallel != 1:
+            print("Logs for each host are in {}".format(log_dir))
+
+        return failed
+
+    def _install_golden(self, hosts, args):
+        import functools
+
+        from lcitool import golden
+
+        pool = self._config.values["install"]["storage_pool"]
+        pool_dir = golden.get_pool_dir(pool)
+
+        # Hosts running the same operating system usually share a golden
+        # image, and each image only needs to be built once
+        images = {}
+        builders = {}
+        for host in hosts:
+            facts = self._inventory.get_facts(host)
+            name = golden.get_name(facts)
+            path = golden.get_path(pool_dir, name,
+                                   self._get_golden_digest(host, facts))
+            images[host] = (name, path)
+            if not path.exists():
+                builders.setdefault(path, host)
+
+        boot_files = {}
+        if not args.no_cache:
+            boot_files = self._prefetch_boot_files(list(builders.values()))
+
+        jobs = {}
+        for path, host in builders.items():
+            url = self._inventory.get_facts(host)["install"]["url"]
+            jobs[path.stem] = functools.partial(self._build_golden,
+                                                host, path,
+                                                boot_files=boot_files.get(url))
+        failed_images = self._run_install_jobs(jobs, args.parallel)
+
+        jobs = {}
+        failed = []
+        current = {}
+        for host in hosts:
+            name, path = images[host]
+            current.setdefault(name, set()).add(path)
+            if path.stem in failed_images:
+                failed.append(host)
+                continue
+            jobs[host] = functools.partial(self._clone_host,
+                                           host, path, args.replace)
+        failed.extend(self._run_install_jobs(jobs, args.parallel))
+
+        # Guests created from outdated golden images keep working, since
+        # images are only removed once nothing is based on them anymore
+        golden.prune(pool_dir, current)
+        golden.refresh_pool(pool)
+
+        return failed
+
+    def _action_install(self, args):
+        import functools
+
+        config = self._config
+
+        config.validate_vm_settings()
+
+        if args.parallel < 1:
+            raise Exception(
+                "Invalid number of parallel installations '{}'".format(
+                    args.parallel)
+            )
+        if args.replace and not args.golden:
+            raise Exception("Replacing guests requires golden images")
+        if args.wait and args.golden:
+            # Golden images are always waited for, and guests created from
+            # them are ready as soon as they've been defined
+            raise Exception("Waiting is not supported with golden images")
+
+        hosts = self._inventory.expand_pattern(args.hosts)
+
+        if args.golden:
+            failed = self._install_golden(hosts, args)
+        else:
+            boot_files = {}
+            if not args.no_cache:
+                boot_files = self._prefetch_boot_files(hosts)
+
+            jobs = {}
+            for host in hosts:
+                facts = self._inventory.get_facts(host)
+                url = facts.get("install", {}).get("url")
+                jobs[host] = functools.partial(self._install_host,
+                                               host, args.wait,
+                                               boot_files=boot_files.get(url))
+            failed = self._run_install_jobs(jobs, args.parallel)
+
+        if failed:
+            raise Exception(
+                "Failed to install {} out of {} hosts: {}".format(
+                    len(failed), len(hosts), ", ".join(failed))
+            )
 
     def _action_update(self, args):
         self._execute_playbook("update", args.hosts, args.projects,
-                               args.git_revision)
+                               args.git_revision, args.forks, args.shards)
 
     def _action_build(self, args):
         self._execute_playbook("build", args.hosts, args.projects,
-                               args.git_revision)
+                               args.git_revision, args.forks, args.shards,
+                               args.force)
 
     def _action_variables(self, args):
-        print(VariablesFormatter(self._projects, self._inventory).format(args))
+        from lcitool.formatters import VariablesFormatter
+
+        formatter = VariablesFormatter(self._projects,
+                                       self._inventory,
+                                       self._resolver)
+
+        with timings.phase("format variables", "format"):
+            if args.fingerprint:
+                output = formatter.fingerprint(args)
+            else:
+                output = formatter.format(args)
+
+        print(output)
 
     def _action_dockerfile(self, args):
-        print(DockerfileFormatter(self._projects,
-                                  self._inventory).format(args))
+        from lcitool.formatters import DockerfileFormatter
+
+        formatter = DockerfileFormatter(self._projects,
+                                        self._inventory,
+                                        self._resolver)
+
+        if args.output_dir is None:
+            if args.layers is not None:
+                raise Exception("Layering requires --output-dir")
+            with timings.phase("format dockerfile", "format"):
+                if args.fingerprint:
+                    output = formatter.fingerprint(args)
+                else:
+                    output = formatter.format(args)
+            print(output)
+            return
+
+        if args.fingerprint:
+            raise Exception("Can't compute fingerprints with --output-dir")
+
+        output_dir = Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        with timings.phase("format dockerfiles", "format"):
+            dockerfiles = list(formatter.format_batch(args))
+
+        for name, dockerfile in dockerfiles:
+            dockerfile_path = Path(output_dir, name + ".Dockerfile")
+            with open(dockerfile_path, "w") as fp:
+                fp.write(dockerfile + "\n")
+            print(dockerfile_path.as_posix())
+
+    @staticmethod
+    def _get_snapshot(revision):
+        from lcitool import snapshot
+
+        # Anything that's not a snapshot file is assumed to be a git
+        # revision, and no revision at all means the working tree
+        if revision is None:
+            return snapshot.take()
+        if Path(revision).is_file():
+            return snapshot.load(revision)
+        return snapshot.take(snapshot.get_tree(revision))
+
+    def _action_diff(self, args):
+        from lcitool import snapshot
+
+        if args.old is None and args.save is None:
+            raise Exception("Nothing to compare against")
+
+        new = self._get_snapshot(args.new)
+        if args.save is not None:
+            snapshot.save(new, args.save)
+
+        if args.old is None:
+            return
+
+        old = self._get_snapshot(args.old)
+        for name, changes in snapshot.compare(old, new):
+            print("{}: {}".format(name, ", ".join(changes)))
+
+    def _action_check(self, args):
+        from lcitool import check
+        from lcitool.formatters import VariablesFormatter
+
+        errors = check.check_mappings(self._inventory, self._projects)
+        for error in errors:
+            print(error)
+        if errors:
+            raise Exception(
+                "Found {} problems in the mappings".format(len(errors)))
+
+        # Now that we know the mappings are fine, we can compile tables
+        # for all combinations later runs might need: packages are
+        # installed on guests using the configured architecture, while
+        # the generators use the one lcitool is running on
+        formatter = VariablesFormatter(self._projects,
+                                       self._inventory,
+                                       self._resolver)
+        native_arch = util.get_native_arch()
+        install_arch = self._config.values["install"]["arch"]
+
+        tables = 0
+        for host in self._inventory.expand_pattern("all"):
+            facts = self._inventory.get_facts(host)
+
+            combinations = [(None, install_arch)]
+            if native_arch != install_arch:
+                combinations.append((None, native_arch))
+            for cross_arch in util.get_arches():
+                if formatter._generator_get_unsupported(
+                        host, facts, cross_arch) is not None:
+                    continue
+                combinations.append((cross_arch, native_arch))
+
+            for cross_arch, arch in combinations:
+                self._resolver.compile_table(facts, cross_arch, arch)
+                tables += 1
+
+        print("Mappings are consistent, compiled {} tables".format(tables))
+
+    def _action_serve(self, args):
+        from lcitool.server import Server
+
+        Server().serve(args.socket)
 
     def run(self, args):
-        args.func(self, args)
+        if args.timings or args.trace:
+            timings.enable()
+
+        profiler = None
+        if args.profile:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            with timings.phase(args.action, "action"):
+                getattr(self, "_action_" + args.action)(args)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+            if args.timings:
+                timings.report(sys.stderr)
+            if args.trace:
+                timings.write_trace(args.trace)
@@ -0,0 +1,269 @@
+# bootcache.py - module containing the local cache of install kernels
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import configparser
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from lcitool import cache, timings, util
+
+# Files are downloaded in chunks of this size
+_CHUNK_SIZE = 1024 * 1024
+
+# Timeout for each network operation, in seconds
+_TIMEOUT = 60
+
+
+def _get_cache_dir():
+    return Path(cache.get_cache_dir(), "boot")
+
+
+def _get_object_path(digest):
+    return Path(_get_cache_dir(), "objects", digest)
+
+
+def _get_index_path(url):
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return Path(_get_cache_dir(), "urls", name + ".json")
+
+
+def _join(url, path):
+    return url.rstrip("/") + "/" + path
+
+
+def _open(url, headers=None):
+    if headers is None:
+        headers = {}
+    headers["User-Agent"] = "lcitool"
+
+    request = urllib.request.Request(url, headers=headers)
+    return urllib.request.urlopen(request, timeout=_TIMEOUT)
+
+
+def _get_boot_files(os_name, arch):
+    # These are the same locations virt-install itself would look into
+    # when given the install URL through --location
+    if os_name in ["CentOS", "Fedora"]:
+        return ("images/pxeboot/vmlinuz", "images/pxeboot/initrd.img")
+    if os_name in ["Debian", "Ubuntu"]:
+        prefix = "current/images/netboot/{}-installer/{}/".format(
+            os_name.lower(), util.native_arch_to_deb_arch(arch))
+        return (prefix + "linux", prefix + "initrd.gz")
+    if os_name == "OpenSUSE":
+        prefix = "boot/{}/loader/".format(arch)
+        return (prefix + "linux", prefix + "initrd")
+    return None
+
+
+def _get_checksums(url, os_name):
+    # Install trees usually come with a list of checksums for the files
+    # they contain, which lets us figure out whether the copy we have is
+    # still current without downloading anything big. Not having one is
+    # fine: we'll just ask the server instead
+    checksums = {}
+
+    try:
+        if os_name in ["CentOS", "Fedora"]:
+            with _open(_join(url, ".treeinfo")) as response:
+                content = response.read().decode("utf-8")
+
+            treeinfo = configparser.ConfigParser(interpolation=None)
+            treeinfo.optionxform = str
+            treeinfo.read_string(content)
+            if treeinfo.has_section("checksums"):
+                for path, value in treeinfo.items("checksums"):
+                    kind, _, digest = value.partition(":")
+                    if kind == "sha256":
+                        checksums[path] = digest
+
+        elif os_name in ["Debian", "Ubuntu"]:
+            with _open(_join(url, "current/images/SHA256SUMS")) as response:
+                content = response.read().decode("utf-8")
+
+            for line in content.splitlines():
+                digest, _, path = line.partition(" ")
+                path = path.strip()
+                if path.startswith("./"):
+                    path = path[2:]
+                checksums["current/images/" + path] = digest
+    except Exception:
+        return {}
+
+    return checksums
+
+
+def _load_index(url):
+    try:
+        with open(_get_index_path(url), "r") as fp:
+            return json.load(fp)
+    except Exception:
+        return None
+
+
+def _save_index(url, index):
+    index_path = _get_index_path(url)
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=index_path.parent,
+                                         prefix=index_path.name,
+                                         delete=False) as fp:
+            json.dump(index, fp)
+        os.replace(fp.name, index_path)
+    except Exception:
+        # The file has been downloaded already, all we lose is the
+        # ability to revalidate it cheaply next time
+        pass
+
+
+def _fetch(url, expected=None):
+    # If we know the checksum of the file, we might have it already
+    # regardless of which URL we got it from in the first place
+    if expected is not None:
+        object_path = _get_object_path(expected)
+        if object_path.exists():
+            return object_path
+
+    # Otherwise, let the server tell us whether the copy we downloaded
+    # last time is still current
+    headers = {}
+    index = _load_index(url)
+    if (expected is None and index is not None and
+        _get_object_path(index["sha256"]).exists()):
+        if index.get("etag"):
+            headers["If-None-Match"] = index["etag"]
+        if index.get("last_modified"):
+            headers["If-Modified-Since"] = index["last_modified"]
+
+    try:
+        response = _open(url, headers)
+    except urllib.error.HTTPError as ex:
+        if ex.code == 304 and headers:
+            return _get_object_path(index["sha256"])
+        raise
+
+    objects_dir = Path(_get_cache_dir(), "objects")
+    objects_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    with response, tempfile.NamedTemporaryFile(dir=objects_dir,
+                                               prefix="tmp",
+                                               delete=False) as fp:
+        try:
+            while True:
+                chunk = response.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                fp.write(chunk)
+        except Exception:
+            os.unlink(fp.name)
+            raise
+
+    digest = digest.hexdigest()
+    if expected is not None and digest != expected:
+        os.unlink(fp.name)
+        raise Exception(
+            "Checksum mismatch for '{}': expected {}, got {}".format(
+                url, expected, digest)
+        )
+
+    # Objects are named after their contents, so concurrent downloads of
+    # the same file can safely replace each other
+    object_path = _get_object_path(digest)
+    os.replace(fp.name, object_path)
+
+    _save_index(url, {
+        "sha256": digest,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    })
+
+    return object_path
+
+
+def prefetch(url, os_name, arch):
+    """
+    Makes sure the kernel and initrd for an install tree are available
+    locally, downloading them if necessary.
+
+    Files are stored under $XDG_CACHE_HOME/lcitool/boot and named after
+    their SHA-256 checksum. When the install tree publishes checksums,
+    they're used to tell whether the local copies are current; otherwise
+    a conditional request is made, so that unchanged files are not
+    downloaded again either way.
+
+    :param url: URL of the install tree, as found in the inventory
+    :param os_name: name of the operating system, eg. "Fedora"
+    :param arch: architecture the guest is going to be installed for
+    :returns: paths of the kernel and the initrd, or None if we don't
+              know where to find them for the operating system
+    """
+
+    boot_files = _get_boot_files(os_name, arch)
+    if boot_files is None:
+        return None
+
+    with timings.phase("prefetch " + url, "download"):
+        checksums = _get_checksums(url, os_name)
+
+        paths = []
+        for boot_file in boot_files:
+            paths.append(_fetch(_join(url, boot_file),
+                                checksums.get(boot_file)))
+
+    return tuple(paths)
+
+
+def _cpio_entry(name, mode, data):
+    # "newc" format, which is what the kernel expects: a fixed size header
+    # with all fields in hex, then the name and the data, each of them
+    # padded to a multiple of four bytes
+    name = name.encode("utf-8") + b"\0"
+    fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+    header = b"070701" + b"".join([b"%08X" % f for f in fields])
+
+    entry = header + name
+    entry += b"\0" * (-len(entry) % 4)
+    entry += data
+    entry += b"\0" * (-len(entry) % 4)
+    return entry
+
+
+def inject(initrd, files, path):
+    """
+    Creates a copy of an initrd with some additional files in it.
+
+    The files are stored in a compressed cpio archive which is appended
+    to the original initrd: the kernel unpacks all of them in order when
+    booting, so they show up in the root directory along with the rest of
+    the initrd contents. This is the same thing virt-install does when
+    asked to --initrd-inject files, except that it's only able to do so
+    for the initrd it downloads itself.
+
+    :param initrd: path of the original initrd
+    :param files: dictionary mapping the names of the files to inject to
+                  their contents, as strings
+    :param path: path to store the new initrd at
+    """
+
+    archive = b""
+    for name, content in sorted(files.items()):
+        archive += _cpio_entry(name, 0o100644, content.encode("utf-8"))
+    archive += _cpio_entry("TRAILER!!!", 0, b"")
+
+    with open(initrd, "rb") as src, open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+
+        # Archives must start at a four bytes boundary
+        dst.write(b"\0" * (-dst.tell() % 4))
+        dst.write(gzip.compress(archive, mtime=0))
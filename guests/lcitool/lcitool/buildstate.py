@@ -0,0 +1,55 @@
+# buildstate.py - module containing the record of successful builds
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from lcitool import cache
+
+
+class BuildState:
+    """
+    Keeps track of the inputs of the last successful build of each
+    project on each host, so that builds can be skipped when those
+    inputs haven't changed.
+
+    The state is stored in JSON format under $XDG_CACHE_HOME/lcitool.
+    """
+
+    def __init__(self):
+        self._path = Path(cache.get_cache_dir(), "build-state.json")
+
+        try:
+            with open(self._path, "r") as fp:
+                self._state = json.load(fp)
+        except FileNotFoundError:
+            self._state = {}
+        except Exception as ex:
+            raise Exception(
+                "Invalid build state file ({}): {}".format(self._path, ex))
+
+    def is_current(self, host, project, inputs):
+        # If we couldn't figure out which commit is going to be built, we
+        # have no choice but to build it again
+        if inputs["commit"] is None:
+            return False
+
+        return self._state.get(host, {}).get(project) == inputs
+
+    def update(self, host, project, inputs):
+        self._state.setdefault(host, {})[project] = inputs
+
+    def save(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile("w",
+                                         dir=self._path.parent,
+                                         prefix=self._path.name,
+                                         delete=False) as fp:
+            json.dump(self._state, fp, indent=2, sort_keys=True)
+        os.replace(fp.name, self._path)
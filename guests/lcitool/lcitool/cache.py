@@ -0,0 +1,165 @@
+# cache.py - module containing the on-disk cache for parsed data files
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import os
+from pathlib import Path
+
+from lcitool import util
+
+
+def get_cache_dir():
+    try:
+        cache_dir = Path(os.environ["XDG_CACHE_HOME"])
+    except KeyError:
+        cache_dir = Path(os.environ["HOME"], ".cache")
+
+    return Path(cache_dir, "lcitool")
+
+
+def _get_entry_path(path):
+    import hashlib
+
+    name = hashlib.sha256(path.encode("utf-8")).hexdigest()
+    return Path(get_cache_dir(), "yaml", name + ".pickle")
+
+
+def _read_entry(entry_path):
+    import mmap
+    import pickle
+
+    try:
+        # Mapping the file avoids the many small reads pickle.load()
+        # would perform
+        with open(entry_path, "rb") as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return pickle.loads(mm)
+    except Exception:
+        # A missing, truncated or otherwise unusable entry is simply
+        # treated as a cache miss
+        return None
+
+
+def _write_entry(entry_path, entry):
+    import pickle
+    import tempfile
+
+    try:
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first and rename it afterwards, so
+        # that concurrent lcitool processes never see a partial entry
+        with tempfile.NamedTemporaryFile(dir=entry_path.parent,
+                                         prefix=entry_path.name,
+                                         delete=False) as fp:
+            pickle.dump(entry, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fp.name, entry_path)
+    except Exception:
+        # Failing to update the cache should never prevent lcitool from
+        # working, it will only make the next run slower
+        pass
+
+
+def _get_signature(sources):
+    signature = []
+    for path in sources:
+        stat = Path(path).stat()
+        signature.append((Path(path).as_posix(),
+                          stat.st_mtime_ns,
+                          stat.st_size))
+    return signature
+
+
+def load_artifact(name, sources=None):
+    """
+    Loads data stored earlier with save_artifact().
+
+    :param name: name of the artifact
+    :param sources: paths of the files the data was generated from
+                    (optional, defaults to the ones it was stored with)
+    :returns: the data, or None if there's no such artifact or if any
+              of the source files has changed since it was stored
+    """
+
+    entry = _read_entry(Path(get_cache_dir(), "artifacts", name + ".pickle"))
+    if entry is None:
+        return None
+
+    if sources is None:
+        sources = [source[0] for source in entry["sources"]]
+
+    try:
+        if entry["sources"] != _get_signature(sources):
+            return None
+    except OSError:
+        return None
+
+    return entry["data"]
+
+
+def save_artifact(name, sources, data):
+    """
+    Stores data generated from a set of files in the cache.
+
+    Unlike load_yaml(), which takes care of everything by itself, this
+    is meant for data that is expensive to generate, or that has to be
+    validated first, and can be reused for as long as the files it was
+    generated from don't change.
+
+    :param name: name of the artifact
+    :param sources: paths of the files the data was generated from;
+                    directories can be included too, so that files
+                    being added or removed are noticed
+    :param data: the data, which must be picklable
+    """
+
+    entry = {
+        "sources": _get_signature(sources),
+        "data": data,
+    }
+    _write_entry(Path(get_cache_dir(), "artifacts", name + ".pickle"), entry)
+
+
+def load_yaml(path):
+    """
+    Loads a YAML file, using the on-disk cache whenever possible.
+
+    Parsed data is stored in pickle format under $XDG_CACHE_HOME/lcitool
+    and is reused for as long as the modification time and size of the
+    source file don't change. If they do, the contents of the file are
+    hashed and compared to the cached ones, so that touching a file
+    without actually changing it doesn't require parsing it again.
+
+    :param path: path to the YAML file
+    :returns: the parsed contents of the file
+    """
+
+    import hashlib
+
+    path = Path(path).resolve()
+    stat = path.stat()
+    entry_path = _get_entry_path(path.as_posix())
+
+    entry = _read_entry(entry_path)
+    if (entry is not None and
+        entry["mtime"] == stat.st_mtime_ns and
+        entry["size"] == stat.st_size):
+        return entry["data"]
+
+    with open(path, "rb") as infile:
+        content = infile.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if entry is None or entry["digest"] != digest:
+        entry = {
+            "digest": digest,
+            "data": util.yaml_load(content),
+        }
+
+    entry["mtime"] = stat.st_mtime_ns
+    entry["size"] = stat.st_size
+    _write_entry(entry_path, entry)
+
+    return entry["data"]
@@ -0,0 +1,95 @@
+# check.py - module containing the consistency checks for mappings
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from lcitool import util
+
+
+def _get_known_keys(inventory):
+    base_keys = {"default"}
+    for host in inventory.expand_pattern("all"):
+        facts = inventory.get_facts(host)
+        base_keys.add(facts["packaging"]["format"])
+        base_keys.add(facts["os"]["name"])
+        base_keys.add(facts["os"]["name"] + facts["os"]["version"])
+
+    keys = set(base_keys)
+    for arch in util.get_arches():
+        keys.update([arch + "-" + k for k in base_keys])
+
+    cross_policy_keys = set(["cross-policy-" + k for k in base_keys])
+
+    return keys, cross_policy_keys
+
+
+def check_mappings(inventory, projects):
+    """
+    Checks the mappings and the projects for consistency.
+
+    Every package used by a project must have a mapping, and mappings
+    can only refer to package formats, OS names and versions that are
+    used by some host in the inventory, and to known architectures.
+
+    :param inventory: instance of the Inventory class
+    :param projects: instance of the Projects class
+    :returns: list of problems found, as human readable strings
+    """
+
+    mappings = projects.get_mappings()
+    pypi_mappings = projects.get_pypi_mappings()
+    cpan_mappings = projects.get_cpan_mappings()
+
+    keys, cross_policy_keys = _get_known_keys(inventory)
+
+    errors = []
+
+    for package, mapping in sorted(mappings.items()):
+        if not isinstance(mapping, dict):
+            errors.append("Invalid mapping for '{}'".format(package))
+            continue
+
+        for key, value in sorted(mapping.items()):
+            if key in cross_policy_keys:
+                if value not in ["native", "foreign", "skip"]:
+                    errors.append(
+                        "Invalid cross arch policy '{}' for '{}'".format(
+                            value, package))
+            elif key in keys:
+                if value is not None and not isinstance(value, str):
+                    errors.append(
+                        "Invalid value for key '{}' of '{}'".format(
+                            key, package))
+            else:
+                errors.append(
+                    "Unknown key '{}' in mapping for '{}'".format(
+                        key, package))
+
+    for kind, some_mappings in [("PyPI", pypi_mappings),
+                                ("CPAN", cpan_mappings)]:
+        for package, mapping in sorted(some_mappings.items()):
+            if not isinstance(mapping, dict):
+                errors.append(
+                    "Invalid {} mapping for '{}'".format(kind, package))
+                continue
+
+            # Only the default is ever looked up
+            for key in sorted(mapping):
+                if key != "default":
+                    errors.append(
+                        "Unknown key '{}' in {} mapping for '{}'".format(
+                            key, kind, package))
+
+    # Internal projects are checked as well
+    names = projects.expand_pattern("all") + ["base", "unwanted", "cloud-init"]
+    for project in sorted(names):
+        for package in projects.get_packages(project):
+            if (package not in mappings and
+                package not in pypi_mappings and
+                package not in cpan_mappings):
+                errors.append(
+                    "No mapping defined for '{}' (used by '{}')".format(
+                        package, project))
+
+    return errors
@@ -0,0 +1,91 @@
+# client.py - module containing the client for the lcitool server
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+# This module is imported by the thin client, which is meant to start
+# as fast as possible: don't import anything that's not strictly needed
+
+import json
+import os
+import socket
+from pathlib import Path
+
+
+def get_socket_path():
+    try:
+        runtime_dir = Path(os.environ["XDG_RUNTIME_DIR"])
+    except KeyError:
+        try:
+            runtime_dir = Path(os.environ["XDG_CACHE_HOME"])
+        except KeyError:
+            runtime_dir = Path(os.environ["HOME"], ".cache")
+
+    return Path(runtime_dir, "lcitool", "lcitool.sock")
+
+
+class Client:
+    """
+    Sends requests to a running 'lcitool serve' instance.
+
+    Requests and responses are JSON objects, each one sent on a single
+    line. A request contains the name of the action ("variables" or
+    "dockerfile") and the same arguments the corresponding command
+    accepts, eg.
+
+      {"action": "dockerfile", "hosts": "libvirt-debian-10",
+       "projects": "libvirt", "cross_arch": "aarch64"}
+
+    while a response contains either the output of the command, as
+    "output" (or "files" when "batch" is requested, mapping the name of
+    each Dockerfile to its contents), along with the messages about
+    unsupported combinations that have been skipped, as "skipped", or
+    an "error" message.
+    """
+
+    def __init__(self, socket_path=None):
+        """
+        Initialize an instance
+
+        :param socket_path: path of the server socket (optional)
+        """
+
+        if socket_path is None:
+            socket_path = get_socket_path()
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(str(socket_path))
+        except Exception as ex:
+            self._socket.close()
+            raise Exception(
+                "Can't connect to lcitool server ({}): {}".format(
+                    socket_path, ex))
+        self._file = self._socket.makefile("rwb")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def request(self, action, **kwargs):
+        """
+        Sends a request and waits for the response.
+
+        :param action: name of the action
+        :param kwargs: arguments of the action
+        :returns: the response, as a dictionary
+        """
+
+        kwargs["action"] = action
+        self._file.write(json.dumps(kwargs).encode("utf-8") + b"\n")
+        self._file.flush()
+
+        line = self._file.readline()
+        if not line:
+            raise Exception("Connection to lcitool server lost")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception(response["error"])
+        return response
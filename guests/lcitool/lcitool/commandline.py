@@ -6,8 +6,6 @@
 
 import argparse
 
-from lcitool.application import Application
-
 
 class CommandLine:
 
@@ -19,6 +17,13 @@ class CommandLine:
 
         self._parser.add_argument("--debug", action="store_true",
                                   help="display debugging information")
+        self._parser.add_argument("--timings", action="store_true",
+                                  help="report the time spent in each phase")
+        self._parser.add_argument("--trace", metavar="PATH",
+                                  help="write the time spent in each phase "
+                                       "as Chrome trace events")
+        self._parser.add_argument("--profile", metavar="PATH",
+                                  help="write cProfile data")
 
         subparsers = self._parser.add_subparsers(metavar="ACTION")
         subparsers.required = True
@@ -47,6 +52,72 @@ class CommandLine:
                 help="target architecture for cross compiler",
             )
 
+        def add_output_dir_arg(parser):
+            parser.add_argument(
+                "-o", "--output-dir",
+                help="write one file per host, project and cross arch "
+                     "(accepts a comma-separated list of cross arches) "
+                     "into this directory",
+            )
+
+        def add_playbook_args(parser):
+            parser.add_argument(
+                "-f", "--forks",
+                help="number of hosts each ansible-playbook process "
+                     "acts on in parallel",
+                type=int,
+            )
+            parser.add_argument(
+                "-s", "--shards",
+                help="split hosts across this many concurrent "
+                     "ansible-playbook processes",
+                type=int,
+                default=1,
+            )
+
+        def add_force_arg(parser):
+            parser.add_argument(
+                "--force",
+                help="build projects even if nothing has changed since "
+                     "the last successful build",
+                default=False,
+                action="store_true",
+            )
+
+        def add_layers_arg(parser):
+            parser.add_argument(
+                "-l", "--layers",
+                help="install packages shared by all projects in a common "
+                     "layer, either repeated in every file or in a "
+                     "separate base file",
+                choices=["shared", "base"],
+            )
+
+        def add_buildkit_arg(parser):
+            parser.add_argument(
+                "--buildkit",
+                help="use BuildKit cache mounts for package downloads",
+                default=False,
+                action="store_true",
+            )
+
+        def add_fingerprint_arg(parser):
+            parser.add_argument(
+                "--fingerprint",
+                help="print a hash of the output instead of the output itself",
+                default=False,
+                action="store_true",
+            )
+
+        def add_format_arg(parser):
+            parser.add_argument(
+                "--format",
+                help="output format; json and yaml accept multiple hosts, "
+                     "projects and (comma-separated) cross arches",
+                default="shell",
+                choices=["shell", "json", "yaml"],
+            )
+
         def add_wait_arg(parser):
             parser.add_argument(
                 "-w", "--wait",
@@ -55,52 +126,130 @@ class CommandLine:
                 action="store_true",
             )
 
+        def add_parallel_arg(parser):
+            parser.add_argument(
+                "-j", "--parallel",
+                help="number of installations to run at the same time",
+                type=int,
+                default=1,
+            )
+
+        def add_no_cache_arg(parser):
+            parser.add_argument(
+                "--no-cache",
+                help="let virt-install fetch the kernel and initrd from the "
+                     "install URL rather than using local copies",
+                default=False,
+                action="store_true",
+            )
+
+        def add_golden_args(parser):
+            parser.add_argument(
+                "--golden",
+                help="create hosts as copies of a golden image for their "
+                     "operating system, building it first if needed",
+                default=False,
+                action="store_true",
+            )
+            parser.add_argument(
+                "--replace",
+                help="replace hosts that already exist (with --golden)",
+                default=False,
+                action="store_true",
+            )
+
         installparser = subparsers.add_parser(
             "install", help="perform unattended host installation")
-        installparser.set_defaults(func=Application._action_install)
+        installparser.set_defaults(action="install")
 
         add_hosts_arg(installparser)
         add_wait_arg(installparser)
+        add_parallel_arg(installparser)
+        add_no_cache_arg(installparser)
+        add_golden_args(installparser)
 
         updateparser = subparsers.add_parser(
             "update", help="prepare hosts and keep them updated")
-        updateparser.set_defaults(func=Application._action_update)
+        updateparser.set_defaults(action="update")
 
         add_hosts_arg(updateparser)
         add_projects_arg(updateparser)
         add_gitrev_arg(updateparser)
+        add_playbook_args(updateparser)
 
         buildparser = subparsers.add_parser(
             "build", help="build projects on hosts")
-        buildparser.set_defaults(func=Application._action_build)
+        buildparser.set_defaults(action="build")
 
         add_hosts_arg(buildparser)
         add_projects_arg(buildparser)
         add_gitrev_arg(buildparser)
+        add_playbook_args(buildparser)
+        add_force_arg(buildparser)
 
         hostsparser = subparsers.add_parser(
             "hosts", help="list all known hosts")
-        hostsparser.set_defaults(func=Application._action_hosts)
+        hostsparser.set_defaults(action="hosts")
 
         projectsparser = subparsers.add_parser(
             "projects", help="list all known projects")
-        projectsparser.set_defaults(func=Application._action_projects)
+        projectsparser.set_defaults(action="projects")
 
         variablesparser = subparsers.add_parser(
             "variables", help="generate variables (doesn't access the host)")
-        variablesparser.set_defaults(func=Application._action_variables)
+        variablesparser.set_defaults(action="variables")
 
         add_hosts_arg(variablesparser)
         add_projects_arg(variablesparser)
         add_cross_arch_arg(variablesparser)
+        add_fingerprint_arg(variablesparser)
+        add_format_arg(variablesparser)
 
         dockerfileparser = subparsers.add_parser(
             "dockerfile", help="generate Dockerfile (doesn't access the host)")
-        dockerfileparser.set_defaults(func=Application._action_dockerfile)
+        dockerfileparser.set_defaults(action="dockerfile")
 
         add_hosts_arg(dockerfileparser)
         add_projects_arg(dockerfileparser)
         add_cross_arch_arg(dockerfileparser)
+        add_output_dir_arg(dockerfileparser)
+        add_layers_arg(dockerfileparser)
+        add_buildkit_arg(dockerfileparser)
+        add_fingerprint_arg(dockerfileparser)
+
+        diffparser = subparsers.add_parser(
+            "diff", help="list images affected by package changes")
+        diffparser.set_defaults(action="diff")
+
+        diffparser.add_argument(
+            "old",
+            nargs="?",
+            help="git revision or snapshot file to compare against",
+        )
+        diffparser.add_argument(
+            "new",
+            nargs="?",
+            help="git revision to compare (default: working tree)",
+        )
+        diffparser.add_argument(
+            "--save",
+            metavar="PATH",
+            help="save a snapshot of the resolved packages to this file",
+        )
+
+        checkparser = subparsers.add_parser(
+            "check", help="check mappings and compile them for later use")
+        checkparser.set_defaults(action="check")
+
+        serveparser = subparsers.add_parser(
+            "serve", help="answer variables/dockerfile requests on a socket")
+        serveparser.set_defaults(action="serve")
+
+        serveparser.add_argument(
+            "--socket",
+            help="path of the socket to listen on "
+                 "(default: $XDG_RUNTIME_DIR/lcitool/lcitool.sock)",
+        )
 
     def parse(self):
         return self._parser.parse_args()
@@ -5,10 +5,9 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import os
-import yaml
 from pathlib import Path
 
-from lcitool import util
+from lcitool import cache, util
 
 
 class Config:
@@ -20,16 +19,14 @@ class Config:
         # NOTE: we should load this from /usr/share once we start packaging
         # lcitool
         base = util.get_base()
-        with open(Path(base, "configs", "config.yaml"), "r") as fp:
-            self.values = yaml.safe_load(fp)
+        self.values = cache.load_yaml(Path(base, "configs", "config.yaml"))
 
         user_config_path = self._get_config_file("config.yaml")
         if not user_config_path.exists():
             return
 
         try:
-            with open(user_config_path, "r") as fp:
-                user_config = yaml.safe_load(fp)
+            user_config = cache.load_yaml(user_config_path)
         except Exception as e:
             raise Exception("Invalid config.yaml file: {}".format(e))
 
@@ -5,9 +5,12 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import abc
+import json
+import sys
 from pathlib import Path
 
 from lcitool import util
+from lcitool.resolver import PackageResolver
 
 
 class Formatter(metaclass=abc.ABCMeta):
@@ -28,6 +31,25 @@ class Formatter(metaclass=abc.ABCMeta):
         """
         pass
 
+    def fingerprint(self, args):
+        """
+        Computes a fingerprint of the output.
+
+        The output itself is hashed, so that the fingerprint changes
+        whenever anything affecting it does, be it the inputs, the
+        options or the formatter code; it's stable across runs and Python
+        versions, so it can be used eg. as image tag to find out whether
+        an image needs to be rebuilt at all.
+
+        :param args: Application class' command line arguments
+        :returns: hex digest of the output
+        """
+
+        return util.get_digest({
+            "generator": self.__class__.__name__.lower(),
+            "output": self.format(args),
+        })
+
     def _get_meson_cross(self, cross_abi):
         base = util.get_base()
         cross_name = "{}.meson".format(cross_abi)
@@ -36,104 +58,13 @@ class Formatter(metaclass=abc.ABCMeta):
 
     def _generator_build_varmap(self,
                                 facts,
-                                mappings,
-                                pypi_mappings,
-                                cpan_mappings,
                                 selected_projects,
                                 cross_arch):
-        pkgs = {}
-        cross_pkgs = {}
-        pypi_pkgs = {}
-        cpan_pkgs = {}
-        base_keys = [
-            "default",
-            facts["packaging"]["format"],
-            facts["os"]["name"],
-            facts["os"]["name"] + facts["os"]["version"],
-        ]
-        cross_keys = []
-        cross_policy_keys = []
-        native_arch = util.get_native_arch()
-
-        if cross_arch:
-            keys = base_keys
-            if facts["packaging"]["format"] == "deb":
-                # For Debian-based distros, the name of the foreign package
-                # is usually the same as the native package, but there might
-                # be architecture-specific overrides, so we have to look both
-                # at the neutral keys and at the specific ones
-                cross_keys = base_keys + [cross_arch + "-" + k for k in base_keys]
-            elif facts["packaging"]["format"] == "rpm":
-                # For RPM-based distros, the name of the foreign package is
-                # usually very different from the native one, so we should
-                # only look at the keys that are specific to cross-building
-                # because otherwise we'd also pick up a bunch of native
-                # packages we don't actually need
-                cross_keys = [cross_arch + "-" + k for k in base_keys]
-            cross_policy_keys = ["cross-policy-" + k for k in base_keys]
-        else:
-            keys = base_keys + [native_arch + "-" + k for k in base_keys]
-
-        # We need to add the base project manually here: the standard
-        # machinery hides it because it's an implementation detail
-        for project in selected_projects + ["base"]:
-            for package in self._projects.get_packages(project):
-                cross_policy = "native"
-
-                if (package not in mappings and
-                    package not in pypi_mappings and
-                    package not in cpan_mappings):
-                    raise Exception(
-                        "No mapping defined for {}".format(package)
-                    )
-
-                if package in mappings:
-                    for key in cross_policy_keys:
-                        if key in mappings[package]:
-                            cross_policy = mappings[package][key]
-
-                    if cross_policy not in ["native", "foreign", "skip"]:
-                        raise Exception(
-                            "Unexpected cross arch policy {} for {}".format
-                            (cross_policy, package))
-
-                    if cross_arch and cross_policy == "foreign":
-                        for key in cross_keys:
-                            if key in mappings[package]:
-                                pkgs[package] = mappings[package][key]
-                    else:
-                        for key in keys:
-                            if key in mappings[package]:
-                                pkgs[package] = mappings[package][key]
-
-                if package in pypi_mappings:
-                    if "default" in pypi_mappings[package]:
-                        pypi_pkgs[package] = pypi_mappings[package]["default"]
-
-                if package in cpan_mappings:
-                    if "default" in cpan_mappings[package]:
-                        cpan_pkgs[package] = cpan_mappings[package]["default"]
-
-                if package in pkgs and pkgs[package] is None:
-                    del pkgs[package]
-                if package in pypi_pkgs and pypi_pkgs[package] is None:
-                    del pypi_pkgs[package]
-                if package in cpan_pkgs and cpan_pkgs[package] is None:
-                    del cpan_pkgs[package]
-                if package in pypi_pkgs and package in pkgs:
-                    del pypi_pkgs[package]
-                if package in cpan_pkgs and package in pkgs:
-                    del cpan_pkgs[package]
-
-                if (package not in pkgs and
-                    package not in pypi_pkgs and
-                    package not in cpan_pkgs):
-                    continue
-
-                if package in pkgs and cross_policy == "foreign":
-                    cross_pkgs[package] = pkgs[package]
-                if package in pkgs and cross_policy in ["skip", "foreign"]:
-                    del pkgs[package]
+        pkgs, cross_pkgs, pypi_pkgs, cpan_pkgs = self._resolver.resolve(
+            facts,
+            selected_projects,
+            cross_arch,
+        )
 
         varmap = {
             "packaging_command": facts["packaging"]["command"],
@@ -173,68 +104,166 @@ class Formatter(metaclass=abc.ABCMeta):
 
         return varmap
 
-    def _generator_prepare(self, args):
+    def _generator_get_unsupported(self, host, facts, cross_arch):
         name = self.__class__.__name__.lower()
-        mappings = self._projects.get_mappings()
-        pypi_mappings = self._projects.get_pypi_mappings()
-        cpan_mappings = self._projects.get_cpan_mappings()
         native_arch = util.get_native_arch()
 
-        hosts = self._inventory.expand_pattern(args.hosts)
-        if len(hosts) > 1:
-            raise Exception(
-                "Can't use '{}' use generator on multiple hosts".format(name)
-            )
-        host = hosts[0]
-
-        facts = self._inventory.get_facts(host)
-        cross_arch = args.cross_arch
-
         # We can only generate Dockerfiles for Linux
         if (name == "dockerfileformatter" and
             facts["packaging"]["format"] not in ["deb", "rpm"]):
-            raise Exception(
-                "Host {} doesn't support '{}' generator".format(host, name)
-            )
+            return "Host {} doesn't support '{}' generator".format(host, name)
         if cross_arch:
             if facts["os"]["name"] not in ["Debian", "Fedora"]:
-                raise Exception("Cannot cross compile on {}".format(
+                return "Cannot cross compile on {}".format(
                     facts["os"]["name"],
-                ))
+                )
             if (facts["os"]["name"] == "Debian" and cross_arch.startswith("mingw")):
-                raise Exception(
-                    "Cannot cross compile for {} on {}".format(
-                        cross_arch,
-                        facts["os"]["name"],
-                    )
+                return "Cannot cross compile for {} on {}".format(
+                    cross_arch,
+                    facts["os"]["name"],
                 )
             if (facts["os"]["name"] == "Fedora" and not cross_arch.startswith("mingw")):
-                raise Exception(
-                    "Cannot cross compile for {} on {}".format(
-                        cross_arch,
-                        facts["os"]["name"],
-                    )
+                return "Cannot cross compile for {} on {}".format(
+                    cross_arch,
+                    facts["os"]["name"],
                 )
             if cross_arch == native_arch:
-                raise Exception("Cross arch {} should differ from native {}".
-                                format(cross_arch, native_arch))
+                return "Cross arch {} should differ from native {}".format(
+                    cross_arch, native_arch)
+        return None
+
+    def _generator_validate(self, host, facts, cross_arch):
+        reason = self._generator_get_unsupported(host, facts, cross_arch)
+        if reason is not None:
+            raise Exception(reason)
+
+    def _generator_get_combinations(self, args, skipped=None):
+        hosts = self._inventory.expand_pattern(args.hosts)
+
+        cross_arches = [None]
+        if args.cross_arch:
+            cross_arches.extend(args.cross_arch.split(","))
+
+        # Unsupported combinations are skipped, but the user gets to know
+        # about each one of them
+        combinations = []
+        for host in hosts:
+            facts = self._inventory.get_facts(host)
+
+            for cross_arch in cross_arches:
+                reason = self._generator_get_unsupported(host, facts,
+                                                         cross_arch)
+                if reason is not None:
+                    target = host
+                    if cross_arch:
+                        target += " (cross {})".format(cross_arch)
+                    message = "Skipping {}: {}".format(target, reason)
+                    if skipped is not None:
+                        skipped.append(message)
+                    else:
+                        print(message, file=sys.stderr)
+                    continue
+
+                combinations.append((host, facts, cross_arch))
+
+        # Skipping is only fine as long as each host the user has asked
+        # for explicitly, and each cross arch, results in something
+        for host in args.hosts.split(","):
+            if host not in hosts:
+                continue
+            if not [c for c in combinations if c[0] == host]:
+                raise Exception(
+                    "Host {} doesn't support any of the requested "
+                    "targets".format(host)
+                )
+        for cross_arch in cross_arches[1:]:
+            if not [c for c in combinations if c[2] == cross_arch]:
+                raise Exception(
+                    "None of the selected hosts supports cross compiling "
+                    "for {}".format(cross_arch)
+                )
+
+        return combinations
 
-        selected_projects = self._projects.expand_pattern(args.projects)
+    def _generator_expand_projects(self, projects):
+        selected_projects = self._projects.expand_pattern(projects)
         for project in selected_projects:
             if project.rfind("+mingw") >= 0:
                 raise Exception("Obsolete syntax, please use --cross-arch")
 
+        return selected_projects
+
+    def _generator_prepare_host(self, host, selected_projects, cross_arch):
+        facts = self._inventory.get_facts(host)
+
         varmap = self._generator_build_varmap(facts,
-                                              mappings,
-                                              pypi_mappings,
-                                              cpan_mappings,
                                               selected_projects,
                                               cross_arch)
         return facts, cross_arch, varmap
 
+    def _generator_prepare_layers(self, host, selected_projects, cross_arch):
+        facts = self._inventory.get_facts(host)
+
+        varmaps = {}
+        for project in selected_projects:
+            varmaps[project] = self._generator_build_varmap(facts,
+                                                            [project],
+                                                            cross_arch)
+
+        # Packages needed by all projects go into a common layer, and each
+        # project only adds whatever it needs on top of that
+        keys = ["pkgs", "cross_pkgs", "pypi_pkgs", "cpan_pkgs"]
+        common = {}
+        for key in keys:
+            common[key] = None
+            for varmap in varmaps.values():
+                pkgs = set(varmap.get(key, []))
+                if common[key] is None:
+                    common[key] = pkgs
+                else:
+                    common[key] &= pkgs
+
+        common_varmap = dict(varmaps[selected_projects[0]])
+        extra_varmaps = {}
+        for key in keys:
+            if key not in common_varmap:
+                continue
+            if not common[key] and key in ["pypi_pkgs", "cpan_pkgs"]:
+                del common_varmap[key]
+            else:
+                common_varmap[key] = sorted(common[key])
+
+        for project, varmap in varmaps.items():
+            extra_varmaps[project] = dict(varmap)
+            for key in keys:
+                if key in varmap:
+                    extra = set(varmap[key]) - common[key]
+                    extra_varmaps[project][key] = sorted(extra)
+
+        return facts, common_varmap, extra_varmaps
+
+    def _generator_prepare(self, args):
+        name = self.__class__.__name__.lower()
+
+        hosts = self._inventory.expand_pattern(args.hosts)
+        if len(hosts) > 1:
+            raise Exception(
+                "Can't use '{}' use generator on multiple hosts".format(name)
+            )
+        host = hosts[0]
+
+        facts = self._inventory.get_facts(host)
+        cross_arch = args.cross_arch
+
+        self._generator_validate(host, facts, cross_arch)
+
+        selected_projects = self._generator_expand_projects(args.projects)
+
+        return self._generator_prepare_host(host, selected_projects, cross_arch)
+
 
 class DockerfileFormatter(Formatter):
-    def __init__(self, projects, inventory):
+    def __init__(self, projects, inventory, resolver=None):
         """
         Initialize an instance
 
@@ -243,14 +272,68 @@ class DockerfileFormatter(Formatter):
 
         :param projects: instance of the Projects class
         :param inventory: instance of the Inventory class
+        :param resolver: instance of the PackageResolver class, shared
+                         with other formatters (optional)
         """
 
+        if resolver is None:
+            resolver = PackageResolver(projects)
+
         self._projects = projects
         self._inventory = inventory
+        self._resolver = resolver
 
-    def _format_dockerfile(self, facts, cross_arch, varmap):
+    @staticmethod
+    def _get_buildkit_cache(facts):
+        # Package managers need to be told not to throw away downloaded
+        # packages, which will end up in a cache mount rather than in the
+        # image itself
+        command = facts["packaging"]["command"]
+        if command == "apt-get":
+            targets = ["/var/cache/apt", "/var/lib/apt"]
+            setup = [
+                "rm -f /etc/apt/apt.conf.d/docker-clean",
+                "echo 'Binary::apt::APT::Keep-Downloaded-Packages \"true\";' > /etc/apt/apt.conf.d/keep-cache",
+            ]
+        elif command == "dnf":
+            targets = ["/var/cache/dnf"]
+            setup = ["echo keepcache=1 >> /etc/dnf/dnf.conf"]
+        elif command == "yum":
+            targets = ["/var/cache/yum"]
+            setup = ["echo keepcache=1 >> /etc/yum.conf"]
+        elif command == "zypper":
+            targets = ["/var/cache/zypp"]
+            setup = ["{packaging_command} modifyrepo --all --keep-packages"]
+        else:
+            targets = []
+            setup = []
+
+        return targets, setup
+
+    @staticmethod
+    def _get_run(mounts):
+        if not mounts:
+            return "\nRUN "
+
+        # Cache mounts go on a line of their own to keep things readable
+        options = ["--mount=type=cache,target={},sharing=locked".format(m)
+                   for m in mounts]
+        return "\nRUN " + " ".join(options) + " \\\n    "
+
+    def _format_dockerfile(self, facts, cross_arch, varmap, buildkit=False):
         strings = []
 
+        pm_mounts = []
+        pypi_mounts = []
+        cpan_mounts = []
+        if buildkit:
+            pm_mounts, pm_setup = self._get_buildkit_cache(facts)
+            pypi_mounts = ["/root/.cache/pip"]
+            cpan_mounts = ["/root/.cpanm"]
+
+            # Cache mounts are not part of the original Dockerfile syntax
+            strings.append("# syntax=docker/dockerfile:1")
+
         pkg_align = " \\\n" + (" " * len("RUN " + facts["packaging"]["command"] + " "))
         pypi_pkg_align = " \\\n" + (" " * len("RUN pip3 "))
         cpan_pkg_align = " \\\n" + (" " * len("RUN cpanm "))
@@ -268,6 +351,9 @@ class DockerfileFormatter(Formatter):
 
         commands = []
 
+        if buildkit:
+            commands.extend(pm_setup)
+
         if facts["packaging"]["format"] == "deb":
             commands.extend([
                 "export DEBIAN_FRONTEND=noninteractive",
@@ -275,7 +361,12 @@ class DockerfileFormatter(Formatter):
                 "{packaging_command} dist-upgrade -y",
                 "{packaging_command} install --no-install-recommends -y {pkgs}",
                 "{packaging_command} autoremove -y",
-                "{packaging_command} autoclean -y",
+            ])
+            if not buildkit:
+                commands.extend([
+                    "{packaging_command} autoclean -y",
+                ])
+            commands.extend([
                 "sed -Ei 's,^# (en_US\\.UTF-8 .*)$,\\1,' /etc/locale.gen",
                 "dpkg-reconfigure locales",
             ])
@@ -338,14 +429,18 @@ class DockerfileFormatter(Formatter):
             # openSUSE doesn't seem to have a convenient way to remove all
             # unnecessary packages, but CentOS and Fedora do
             if facts["os"]["name"] == "OpenSUSE":
-                commands.extend([
-                    "{packaging_command} clean --all",
-                ])
+                if not buildkit:
+                    commands.extend([
+                        "{packaging_command} clean --all",
+                    ])
             else:
                 commands.extend([
                     "{packaging_command} autoremove -y",
-                    "{packaging_command} clean all -y",
                 ])
+                if not buildkit:
+                    commands.extend([
+                        "{packaging_command} clean all -y",
+                    ])
 
         commands.extend([
             "mkdir -p /usr/libexec/ccache-wrappers",
@@ -362,7 +457,7 @@ class DockerfileFormatter(Formatter):
                 "ln -s {paths_ccache} /usr/libexec/ccache-wrappers/$(basename {paths_cc})",
             ])
 
-        script = "\nRUN " + (" && \\\n    ".join(commands))
+        script = self._get_run(pm_mounts) + (" && \\\n    ".join(commands))
         strings.append(script.format(**varmap))
 
         if cross_arch:
@@ -380,13 +475,19 @@ class DockerfileFormatter(Formatter):
                     "{packaging_command} install --no-install-recommends -y dpkg-dev",
                     "{packaging_command} install --no-install-recommends -y {cross_pkgs}",
                     "{packaging_command} autoremove -y",
-                    "{packaging_command} autoclean -y",
                 ])
+                if not buildkit:
+                    cross_commands.extend([
+                        "{packaging_command} autoclean -y",
+                    ])
             elif facts["packaging"]["format"] == "rpm":
                 cross_commands.extend([
                     "{packaging_command} install -y {cross_pkgs}",
-                    "{packaging_command} clean all -y",
                 ])
+                if not buildkit:
+                    cross_commands.extend([
+                        "{packaging_command} clean all -y",
+                    ])
 
             if not cross_arch.startswith("mingw"):
                 cross_commands.extend([
@@ -397,14 +498,16 @@ class DockerfileFormatter(Formatter):
                 cross_meson = self._get_meson_cross(varmap["cross_abi"])
                 varmap["cross_meson"] = cross_meson.replace("\n", "\\n\\\n")
 
-            cross_script = "\nRUN " + (" && \\\n    ".join(cross_commands))
+            cross_script = self._get_run(pm_mounts) + (" && \\\n    ".join(cross_commands))
             strings.append(cross_script.format(**varmap))
 
         if "pypi_pkgs" in varmap:
-            strings.append("\nRUN pip3 install {pypi_pkgs}".format(**varmap))
+            pypi_script = self._get_run(pypi_mounts) + "pip3 install {pypi_pkgs}"
+            strings.append(pypi_script.format(**varmap))
 
         if "cpan_pkgs" in varmap:
-            strings.append("\nRUN cpanm --notest {cpan_pkgs}".format(**varmap))
+            cpan_script = self._get_run(cpan_mounts) + "cpanm --notest {cpan_pkgs}"
+            strings.append(cpan_script.format(**varmap))
 
         common_vars = [
             "ENV LANG \"en_US.UTF-8\"",
@@ -438,6 +541,67 @@ class DockerfileFormatter(Formatter):
 
         return strings
 
+    def _format_dockerfile_extra(self, facts, cross_arch, varmap,
+                                 buildkit=False):
+        strings = []
+
+        pm_mounts = []
+        pypi_mounts = []
+        cpan_mounts = []
+        if buildkit:
+            # The package manager has already been configured to keep its
+            # cache by the Dockerfile we're adding to
+            pm_mounts, _ = self._get_buildkit_cache(facts)
+            pypi_mounts = ["/root/.cache/pip"]
+            cpan_mounts = ["/root/.cpanm"]
+
+        pkg_align = " \\\n" + (" " * len("    " + facts["packaging"]["command"] + " "))
+        pypi_pkg_align = " \\\n" + (" " * len("RUN pip3 "))
+        cpan_pkg_align = " \\\n" + (" " * len("RUN cpanm "))
+
+        if facts["packaging"]["format"] == "deb":
+            install = "{packaging_command} install --no-install-recommends -y {pkgs}"
+            prepare = [
+                "export DEBIAN_FRONTEND=noninteractive",
+                "{packaging_command} update",
+            ]
+            cleanup = [
+                "{packaging_command} autoremove -y",
+            ]
+            if not buildkit:
+                cleanup.append("{packaging_command} autoclean -y")
+        elif facts["packaging"]["format"] == "rpm":
+            install = "{packaging_command} install -y {pkgs}"
+            prepare = []
+            cleanup = []
+            if not buildkit:
+                if facts["os"]["name"] == "OpenSUSE":
+                    cleanup.append("{packaging_command} clean --all")
+                else:
+                    cleanup.append("{packaging_command} clean all -y")
+
+        # Each kind of package gets its own layer, just like in the
+        # Dockerfile these are added on top of
+        for key in ["pkgs", "cross_pkgs"]:
+            if not varmap.get(key):
+                continue
+
+            pkgs = pkg_align[1:] + pkg_align.join(varmap[key])
+            commands = prepare + [install.replace("{pkgs}", pkgs)] + cleanup
+
+            script = self._get_run(pm_mounts) + (" && \\\n    ".join(commands))
+            strings.append(script.format(**varmap))
+
+        if varmap.get("pypi_pkgs"):
+            pypi_pkgs = pypi_pkg_align[1:] + pypi_pkg_align.join(varmap["pypi_pkgs"])
+            strings.append(self._get_run(pypi_mounts) + "pip3 install " + pypi_pkgs)
+
+        if varmap.get("cpan_pkgs"):
+            cpan_pkgs = cpan_pkg_align[1:] + cpan_pkg_align.join(varmap["cpan_pkgs"])
+            strings.append(self._get_run(cpan_mounts) + "cpanm --notest " + cpan_pkgs)
+
+        return strings
+
     def format(self, args):
         """
         Generates and formats a Dockerfile.
@@ -453,11 +617,104 @@ class DockerfileFormatter(Formatter):
 
         facts, cross_arch, varmap = self._generator_prepare(args)
 
-        return '\n'.join(self._format_dockerfile(facts, cross_arch, varmap))
+        return '\n'.join(self._format_dockerfile(facts, cross_arch, varmap,
+                                                  args.buildkit))
+
+    def format_batch(self, args, skipped=None):
+        """
+        Generates and formats Dockerfiles for many targets at once.
+
+        Given the application commandline arguments, this function will
+        generate a Dockerfile for every combination of the selected hosts,
+        the selected projects and the native architecture plus each of the
+        (comma-separated) cross architectures. Combinations which are not
+        supported, eg. cross compiling on a distro which can't do that,
+        are skipped with a message on standard error, or appended to the
+        skipped list if one is provided; it's an error for a host named
+        explicitly, or for a cross architecture, not to result in any
+        Dockerfile at all.
+
+        When layering is requested, packages needed by all the selected
+        projects are installed in a first step which is the same for all
+        of them, so that the resulting images share that layer, and only
+        the packages specific to each project are installed on top of it.
+        The common part can either be repeated in every Dockerfile
+        ("shared") or emitted as a separate base Dockerfile ("base"),
+        which the per-project ones then refer to.
+
+        :param args: Application class' command line arguments
+        :param skipped: list to store messages about skipped combinations
+                        in (optional)
+        :returns: iterator of (name, Dockerfile) tuples, where name
+                  identifies the host, project and cross architecture
+        """
+
+        selected_projects = self._generator_expand_projects(args.projects)
+
+        for host, facts, cross_arch in self._generator_get_combinations(
+                args, skipped):
+            if args.layers is not None:
+                yield from self._format_batch_layers(args.layers, host,
+                                                     selected_projects,
+                                                     cross_arch,
+                                                     args.buildkit)
+                continue
+
+            for project in selected_projects:
+                facts, _, varmap = self._generator_prepare_host(host,
+                                                                [project],
+                                                                cross_arch)
+
+                name = "{}-{}".format(host, project)
+                if cross_arch:
+                    name += "-cross-{}".format(cross_arch)
+
+                dockerfile = self._format_dockerfile(facts, cross_arch,
+                                                     varmap, args.buildkit)
+                yield name, '\n'.join(dockerfile)
+
+    def _format_batch_layers(self, layers, host, selected_projects,
+                             cross_arch, buildkit):
+        facts, common_varmap, extra_varmaps = self._generator_prepare_layers(
+            host,
+            selected_projects,
+            cross_arch,
+        )
+
+        suffix = ""
+        if cross_arch:
+            suffix = "-cross-{}".format(cross_arch)
+
+        base_name = "{}-base{}".format(host, suffix)
+        base = self._format_dockerfile(facts, cross_arch, common_varmap,
+                                       buildkit)
+
+        if layers == "base":
+            yield base_name, '\n'.join(base)
+
+        for project in selected_projects:
+            extra = self._format_dockerfile_extra(facts, cross_arch,
+                                                  extra_varmaps[project],
+                                                  buildkit)
+
+            if layers == "base":
+                # The base image is expected to have been built and tagged
+                # using the same name as its Dockerfile, but that can be
+                # overridden at build time
+                strings = [
+                    "ARG BASE_IMAGE={}".format(base_name),
+                    "FROM $BASE_IMAGE",
+                ] + extra
+                if buildkit:
+                    strings.insert(0, "# syntax=docker/dockerfile:1")
+            else:
+                strings = base + extra
+
+            yield "{}-{}{}".format(host, project, suffix), '\n'.join(strings)
 
 
 class VariablesFormatter(Formatter):
-    def __init__(self, projects, inventory):
+    def __init__(self, projects, inventory, resolver=None):
         """
         Initialize an instance
 
@@ -466,29 +723,58 @@ class VariablesFormatter(Formatter):
 
         :param projects: instance of the Projects class
         :param inventory: instance of the Inventory class
+        :param resolver: instance of the PackageResolver class, shared
+                         with other formatters (optional)
         """
 
+        if resolver is None:
+            resolver = PackageResolver(projects)
+
         self._projects = projects
         self._inventory = inventory
+        self._resolver = resolver
 
     @staticmethod
-    def _format_variables(varmap):
-        strings = []
+    def _get_variables(varmap):
+        variables = {}
 
         for key in varmap:
-            if key == "pkgs" or key.endswith("_pkgs"):
-                name = key
-                value = " ".join(varmap[key])
-            elif key.startswith("paths_"):
+            if key.startswith("paths_"):
                 name = key[len("paths_"):]
-                value = varmap[key]
             else:
                 name = key
-                value = varmap[key]
-            strings.append("{}='{}'".format(name.upper(), value))
+            variables[name.upper()] = varmap[key]
+        return variables
+
+    def _format_variables(self, varmap):
+        strings = []
+
+        for name, value in self._get_variables(varmap).items():
+            if isinstance(value, list):
+                value = " ".join(value)
+            strings.append("{}='{}'".format(name, value))
         return strings
 
-    def format(self, args):
+    def _format_matrix(self, args, skipped):
+        selected_projects = self._generator_expand_projects(args.projects)
+
+        matrix = []
+        for host, facts, cross_arch in self._generator_get_combinations(
+                args, skipped):
+            for project in selected_projects:
+                varmap = self._generator_build_varmap(facts,
+                                                      [project],
+                                                      cross_arch)
+                matrix.append({
+                    "host": host,
+                    "project": project,
+                    "cross_arch": cross_arch,
+                    "variables": self._get_variables(varmap),
+                })
+
+        return matrix
+
+    def format(self, args, skipped=None):
         """
         Generates and formats environment variables as KEY=VAL pairs.
 
@@ -496,10 +782,28 @@ class VariablesFormatter(Formatter):
         projects and inventory attributes and generate a KEY=VAL encoded list
         of environment variables that can be consumed by various CI backends.
 
+        When JSON or YAML output is requested, a single document is
+        generated instead, containing a list with the variables for every
+        combination of the selected hosts, the selected projects and the
+        native architecture plus each of the (comma-separated) cross
+        architectures. Combinations which are not supported are skipped,
+        the same way format_batch() of DockerfileFormatter does.
+
         :param args: Application class' command line arguments
+        :param skipped: list to store messages about skipped combinations
+                        in (optional)
         :returns: String represented list of environment variables
         """
 
+        if args.format == "json":
+            return json.dumps(self._format_matrix(args, skipped), indent=2)
+        if args.format == "yaml":
+            import yaml
+
+            return yaml.safe_dump(self._format_matrix(args, skipped),
+                                  default_flow_style=False,
+                                  sort_keys=False).rstrip()
+
         _, _, varmap = self._generator_prepare(args)
 
         return '\n'.join(self._format_variables(varmap))
@@ -0,0 +1,292 @@
+# golden.py - module containing the golden image handling primitives
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from lcitool import timings
+
+# Golden images are named after the operating system they contain, plus
+# a digest of the inputs they've been built from
+_PREFIX = "lcitool-golden-"
+
+
+def _which(name):
+    path = shutil.which(name)
+    if path is None:
+        raise Exception("Cannot find {} in $PATH".format(name))
+    return path
+
+
+def _run(cmd, job=None):
+    # When several guests are being taken care of at the same time, the
+    # output of each command is multiplexed
+    if job is not None:
+        job.run(cmd)
+        return
+
+    phase = " ".join([Path(cmd[0]).name] + cmd[1:2])
+    with timings.phase(phase, "subprocess"):
+        subprocess.check_call(cmd)
+
+
+def get_name(facts):
+    """
+    Returns the name of the golden image for an operating system.
+
+    :param facts: facts of any host running the operating system
+    :returns: the name, eg. "lcitool-golden-fedora-32"
+    """
+
+    return _PREFIX + "{}-{}".format(facts["os"]["name"],
+                                    facts["os"]["version"]).lower()
+
+
+def get_path(pool_dir, name, digest):
+    """
+    Returns the path a golden image is stored at.
+
+    :param pool_dir: directory backing the storage pool
+    :param name: name of the golden image, as returned by get_name()
+    :param digest: digest of the inputs the image has been built from
+    :returns: path of the golden image
+    """
+
+    return Path(pool_dir, "{}-{}.qcow2".format(name, digest[:12]))
+
+
+def get_pool_dir(pool):
+    """
+    Returns the directory backing a storage pool.
+
+    Golden images and guest disks are created with qemu-img directly
+    rather than through libvirt, so only directory pools are supported.
+
+    :param pool: name of the libvirt storage pool
+    :returns: path of the directory
+    """
+
+    try:
+        output = subprocess.check_output([_which("virsh"),
+                                          "pool-dumpxml", pool])
+    except subprocess.CalledProcessError as ex:
+        raise Exception(
+            "Failed to look up storage pool '{}': {}".format(pool, ex)
+        )
+
+    root = ET.fromstring(output)
+    if root.get("type") != "dir":
+        raise Exception(
+            "Storage pool '{}' is not a directory pool".format(pool)
+        )
+
+    return Path(root.findtext("target/path"))
+
+
+def refresh_pool(pool):
+    """
+    Makes libvirt notice the files that have been created in a pool.
+
+    :param pool: name of the libvirt storage pool
+    """
+
+    _run([_which("virsh"), "-q", "pool-refresh", pool])
+
+
+def guest_exists(name):
+    """
+    Checks whether a guest is defined in libvirt.
+
+    :param name: name of the guest
+    :returns: True if the guest exists, False otherwise
+    """
+
+    ret = subprocess.call([_which("virsh"), "-q", "dominfo", name],
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+    return ret == 0
+
+
+def remove_guest(name, job=None):
+    """
+    Stops a guest if it's running and removes it from libvirt.
+
+    Storage is not touched.
+
+    :param name: name of the guest
+    :param job: output.Job to run commands as part of (optional)
+    """
+
+    # This fails if the guest is not running, which is fine
+    subprocess.call([_which("virsh"), "-q", "destroy", name],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+
+    _run([_which("virsh"), "-q", "undefine", name], job)
+
+
+def get_backing_chain(path):
+    """
+    Returns the backing chain of a disk image.
+
+    :param path: path of the disk image
+    :returns: list of the paths making up the chain, starting with the
+              image itself and ending with the image it's ultimately
+              based on
+    """
+
+    output = subprocess.check_output([
+        _which("qemu-img"), "info",
+        "--backing-chain",
+        "--output=json",
+        "-U",
+        str(path),
+    ])
+
+    # The output is a list only when there's more than one image
+    info = json.loads(output)
+    if isinstance(info, dict):
+        info = [info]
+
+    return [Path(image["filename"]) for image in info]
+
+
+def generalize(path, job=None):
+    """
+    Removes from a freshly installed disk image everything that should be
+    unique to each guest, such as machine id and SSH host keys.
+
+    :param path: path of the disk image
+    :param job: output.Job to run commands as part of (optional)
+    """
+
+    # SSH authorized keys are needed to reach guests, so they're kept
+    _run([
+        _which("virt-sysprep"),
+        "-a", str(path),
+        "--operations", "defaults,-ssh-userdir",
+    ], job)
+
+
+def create_overlay(backing, path, job=None):
+    """
+    Creates a disk image which only stores the differences from another.
+
+    :param backing: path of the image the new one is going to be based on
+    :param path: path of the new disk image, which is replaced if it
+                 already exists
+    :param job: output.Job to run commands as part of (optional)
+    """
+
+    _run([
+        _which("qemu-img"), "create",
+        "-q",
+        "-f", "qcow2",
+        "-F", "qcow2",
+        "-b", str(backing),
+        str(path),
+    ], job)
+
+
+def customize(path, host, job=None):
+    """
+    Applies the customizations a guest needs on top of a golden image.
+
+    :param path: path of the guest's disk image
+    :param host: name of the guest
+    :param job: output.Job to run commands as part of (optional)
+    """
+
+    # Host keys have been removed from the golden image, and not all
+    # operating systems regenerate them on boot
+    _run([
+        _which("virt-customize"),
+        "-a", str(path),
+        "--hostname", host,
+        "--run-command", "ssh-keygen -A",
+    ], job)
+
+
+def _get_domain_disks():
+    # Guests might use disk images stored outside of the pool, which
+    # could be based on golden images all the same
+    output = subprocess.check_output([_which("virsh"), "-q",
+                                      "list", "--all", "--name"],
+                                     universal_newlines=True)
+
+    disks = []
+    for domain in output.split():
+        xml = subprocess.check_output([_which("virsh"), "-q",
+                                       "dumpxml", domain])
+        root = ET.fromstring(xml)
+        for source in root.findall("devices/disk/source"):
+            if source.get("file") is not None:
+                disks.append(Path(source.get("file")))
+
+    return disks
+
+
+def _get_images_in_use(pool_dir):
+    in_use = set()
+
+    # Golden images are never based on each other, so they can be
+    # skipped; anything else could be a disk image, regardless of
+    # its name
+    for path in sorted(Path(pool_dir).iterdir()):
+        if path.name.startswith(_PREFIX) or not path.is_file():
+            continue
+        in_use.update([p.resolve() for p in get_backing_chain(path)[1:]])
+
+    # Guests could also be using golden images directly
+    for path in _get_domain_disks():
+        if path.exists():
+            in_use.update([p.resolve() for p in get_backing_chain(path)])
+
+    return in_use
+
+
+def prune(pool_dir, current):
+    """
+    Removes golden images that no guest disk is based on anymore.
+
+    Images are never removed while there's a file in the pool or a disk
+    of any libvirt guest using them as backing file, so rebuilding a
+    golden image doesn't affect the guests created from the previous
+    one. If it's not possible to figure out whether an image is in use,
+    nothing is removed.
+
+    :param pool_dir: directory backing the storage pool
+    :param current: dictionary mapping the names of the golden images
+                    to consider to the set of paths of their current
+                    versions, which are always kept
+    :returns: list of the images that have been removed
+    """
+
+    try:
+        in_use = _get_images_in_use(pool_dir)
+    except Exception:
+        # Better safe than sorry
+        return []
+
+    images = sorted(Path(pool_dir).glob(_PREFIX + "*.qcow2"))
+
+    removed = []
+    for name, paths in current.items():
+        for image in images:
+            # Only look at images get_path() could have returned
+            pattern = re.escape(name) + r"-[0-9a-f]{12}\.qcow2"
+            if (re.fullmatch(pattern, image.name) and
+                image not in paths and
+                image.resolve() not in in_use):
+                os.unlink(image)
+                removed.append(image)
+
+    return removed
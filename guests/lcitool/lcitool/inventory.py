@@ -5,16 +5,26 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import configparser
-import yaml
 from pathlib import Path
 
-from lcitool import util
+from lcitool import cache, timings, util
 
 
 class Inventory:
 
-    def __init__(self):
-        base = Path(util.get_base(), "ansible")
+    def __init__(self, base=None):
+        """
+        Initialize an instance
+
+        :param base: directory containing the ansible/ tree to read the
+                     inventory from (optional, defaults to the one
+                     lcitool is part of)
+        """
+
+        if base is None:
+            base = util.get_base()
+        base = Path(base, "ansible")
+        self._base = base
         ansible_cfg_path = Path(base, "ansible.cfg")
 
         try:
@@ -26,6 +36,7 @@ class Inventory:
                 "Can't read inventory location in ansible.cfg: {}".format(ex))
 
         inventory_path = Path(base, inventory_path)
+        self._inventory_path = inventory_path
 
         self._facts = {}
         try:
@@ -35,7 +46,7 @@ class Inventory:
             with open(inventory_path, "r") as infile:
                 for line in infile:
                     host = line.strip()
-                    self._facts[host] = {}
+                    self._facts[host] = None
         except Exception as ex:
             raise Exception(
                 "Missing or invalid inventory ({}): {}".format(
@@ -43,23 +54,21 @@ class Inventory:
                 )
             )
 
-        for host in self._facts:
-            try:
-                self._facts[host] = self._read_all_facts(host)
-                self._facts[host]["inventory_hostname"] = host
-            except Exception as ex:
-                raise Exception("Can't load facts for '{}': {}".format(
-                    host, ex))
+        # Sorted once here rather than every time a pattern is expanded
+        self._hosts = tuple(sorted(self._facts))
+
+        self._snapshot_loaded = False
+        self._snapshot_name = None
+        self._snapshot_sources = []
 
     @staticmethod
     def _add_facts_from_file(facts, yaml_path):
-        with open(yaml_path, "r") as infile:
-            some_facts = yaml.safe_load(infile)
-            for fact in some_facts:
-                facts[fact] = some_facts[fact]
+        some_facts = cache.load_yaml(yaml_path)
+        for fact in some_facts:
+            facts[fact] = some_facts[fact]
 
-    def _read_all_facts(self, host):
-        base = Path(util.get_base(), "ansible")
+    def _read_all_facts(self, host, files=None):
+        base = self._base
 
         sources = [
             Path(base, "group_vars", "all"),
@@ -72,6 +81,8 @@ class Inventory:
         # files alphabetically; doing so should result in our view of
         # the facts matching Ansible's
         for source in sources:
+            if files is not None:
+                files.append(source)
             for item in sorted(source.iterdir()):
                 yaml_path = Path(source, item)
                 if not yaml_path.is_file():
@@ -79,11 +90,63 @@ class Inventory:
                 if yaml_path.suffix != ".yml":
                     continue
                 self._add_facts_from_file(facts, yaml_path)
+                if files is not None:
+                    files.append(yaml_path)
 
         return facts
 
+    def _load_snapshot(self):
+        # The merged facts of all hosts are stored in a single file, which
+        # is only regenerated when any of the files and directories they
+        # come from has changed: loading that file is all it takes to get
+        # the facts for every host
+        name = "inventory-" + util.get_digest(self._base.as_posix())
+
+        all_facts = cache.load_artifact(name)
+        if all_facts is not None and set(all_facts) == set(self._hosts):
+            self._facts.update(all_facts)
+            return
+
+        # If the snapshot is missing or out of date, facts are loaded one
+        # host at a time as usual, and a new snapshot is only written if
+        # and when the facts for all hosts have been loaded that way: a
+        # command which only needs a single host doesn't have to pay for
+        # all the others
+        self._snapshot_name = name
+        self._snapshot_sources = [self._inventory_path]
+
+    def _save_snapshot(self):
+        if self._snapshot_name is None:
+            return
+        if any(self._facts[host] is None for host in self._hosts):
+            return
+
+        with timings.phase("inventory snapshot", "inventory"):
+            sources = list(dict.fromkeys(self._snapshot_sources))
+            cache.save_artifact(self._snapshot_name, sources, self._facts)
+        self._snapshot_name = None
+
     def expand_pattern(self, pattern):
-        return util.expand_pattern(pattern, self._facts, "host")
+        return util.expand_pattern(pattern, self._hosts, "host")
 
     def get_facts(self, host):
-        return self._facts[host]
+        # Facts are only loaded the first time they're needed, so that
+        # commands that don't need them don't pay for them
+        if not self._snapshot_loaded:
+            self._snapshot_loaded = True
+            self._load_snapshot()
+
+        facts = self._facts[host]
+        if facts is None:
+            try:
+                with timings.phase("facts load", "inventory"):
+                    facts = self._read_all_facts(host,
+                                                 self._snapshot_sources)
+                facts["inventory_hostname"] = host
+            except Exception as ex:
+                raise Exception("Can't load facts for '{}': {}".format(
+                    host, ex))
+            self._facts[host] = facts
+            self._save_snapshot()
+
+        return facts
@@ -0,0 +1,357 @@
+# output.py - module containing the output multiplexer for concurrent commands
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import asyncio
+import concurrent.futures
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from lcitool import timings
+
+# Output is read from commands in chunks of this size, rather than one
+# line at a time, so that very chatty commands can be kept up with
+_CHUNK_SIZE = 64 * 1024
+
+# Lines longer than this are split, so that a command writing a lot of
+# data without any newline can't make us buffer all of it
+_MAX_LINE = 64 * 1024
+
+# Maximum number of chunks waiting to be written out: once it's reached,
+# output is no longer read from commands until some has been written,
+# which makes them block instead of us using more and more memory
+_QUEUE_SIZE = 256
+
+# Data for each log file is written out once there's this much of it
+_LOG_BUFFER_SIZE = 256 * 1024
+
+# How often the live status table is redrawn, in seconds
+_STATUS_INTERVAL = 0.5
+
+
+class Job:
+    """
+    A unit of work, eg. the installation of a host, consisting of one or
+    more commands whose output is multiplexed.
+
+    Jobs are created through Multiplexer.job(), and each one of them
+    takes up a line in the status table and gets its own log file.
+    """
+
+    def __init__(self, multiplexer, tag):
+        self.tag = tag
+        self.phase = None
+        self.state = "waiting"
+        self.lines = 0
+        self.last_line = ""
+        self.start = None
+        self.end = None
+
+        self._multiplexer = multiplexer
+        self._log = None
+        self._log_buffer = []
+        self._log_buffered = 0
+
+    def submit(self, cmd, phase=None, env=None):
+        """
+        Starts running a command without waiting for it to complete.
+
+        :param cmd: command to run, as a list of arguments
+        :param phase: what the job is doing, eg. "virt-install"; defaults
+                      to the name of the command
+        :param env: environment for the command (optional)
+        :returns: a concurrent.futures.Future for the command, which
+                  raises subprocess.CalledProcessError if it fails
+        """
+
+        if phase is None:
+            phase = Path(cmd[0]).name
+
+        return self._multiplexer._submit(self, cmd, phase, env)
+
+    def run(self, cmd, phase=None, env=None):
+        """
+        Runs a command, waiting for it to complete.
+
+        This can be called from any thread, and any number of commands
+        can be running at the same time.
+
+        :param cmd: command to run, as a list of arguments
+        :param phase: what the job is doing, eg. "virt-install"; defaults
+                      to the name of the command
+        :param env: environment for the command (optional)
+        :raises subprocess.CalledProcessError: if the command fails
+        """
+
+        self.submit(cmd, phase, env).result()
+
+    def finish(self, success):
+        """
+        Marks the job as completed.
+
+        :param success: whether the job has completed successfully
+        """
+
+        self.state = "done" if success else "failed"
+        self.end = time.monotonic()
+
+
+class Multiplexer:
+    """
+    Runs commands concurrently and multiplexes their output.
+
+    The output of all commands is read asynchronously by a single event
+    loop running in a background thread. Each line is tagged with the
+    job and phase it belongs to, and is written both to the log file for
+    the job and, unless a live status table is displayed instead, to our
+    own standard output.
+
+    The multiplexer must be used as a context manager: all output has
+    been written out by the time the with statement ends.
+    """
+
+    def __init__(self, log_dir=None, stream=None, live=None):
+        """
+        :param log_dir: directory to store a log file for each job in
+                        (optional)
+        :param stream: file object to write output to (optional,
+                       defaults to standard output)
+        :param live: whether to show a live status table rather than the
+                     output itself (optional, defaults to doing so when
+                     writing to a terminal and log files are stored)
+        """
+
+        if stream is None:
+            stream = sys.stdout
+        if live is None:
+            live = log_dir is not None and stream.isatty()
+
+        self._log_dir = log_dir
+        self._stream = stream
+        self._live = live
+        self._jobs = []
+        self._status_lines = 0
+
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._writer = None
+        self._status = None
+
+        # Writing to the terminal or to disk could block, so it happens
+        # in a separate thread; there's a single one, so that output is
+        # written in the order it was read in
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def job(self, tag):
+        """
+        Creates a new job.
+
+        :param tag: name of the job, eg. the name of a host, which output
+                    lines and the log file are tagged with
+        :returns: instance of the Job class
+        """
+
+        job = Job(self, tag)
+        self._jobs.append(job)
+        return job
+
+    def __enter__(self):
+        if self._log_dir is not None:
+            Path(self._log_dir).mkdir(parents=True, exist_ok=True)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            asyncio.run_coroutine_threadsafe(self._teardown(),
+                                             self._loop).result()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._executor.shutdown()
+
+    async def _setup(self):
+        # The queue has to be created from within the event loop
+        self._queue = asyncio.Queue(_QUEUE_SIZE)
+        self._writer = asyncio.ensure_future(self._write())
+        if self._live:
+            self._status = asyncio.ensure_future(self._update_status())
+
+    async def _teardown(self):
+        await self._queue.put(None)
+        await self._writer
+
+        if self._status is not None:
+            self._status.cancel()
+            await self._run_in_executor(self._draw_status)
+
+        await self._run_in_executor(self._close_logs)
+
+    def _run_in_executor(self, func, *args):
+        return self._loop.run_in_executor(self._executor, func, *args)
+
+    def _submit(self, job, cmd, phase, env):
+        return asyncio.run_coroutine_threadsafe(
+            self._run(job, cmd, phase, env), self._loop)
+
+    async def _run(self, job, cmd, phase, env):
+        job.phase = phase
+        job.state = "running"
+        if job.start is None:
+            job.start = time.monotonic()
+
+        with timings.phase("{} [{}]".format(phase, job.tag), "subprocess"):
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=env,
+            )
+
+            pending = b""
+            while True:
+                chunk = await proc.stdout.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                if len(pending) > _MAX_LINE:
+                    lines.append(pending)
+                    pending = b""
+
+                if lines:
+                    await self._add_lines(job, phase, lines)
+
+            if pending:
+                await self._add_lines(job, phase, [pending])
+
+            returncode = await proc.wait()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    async def _add_lines(self, job, phase, lines):
+        job.lines += len(lines)
+        job.last_line = lines[-1].decode("utf-8", errors="replace").strip()
+
+        # This blocks if the writer can't keep up
+        await self._queue.put((job, phase, lines))
+
+    async def _write(self):
+        done = False
+        while not done:
+            # Everything that's been queued up is written out at once,
+            # which is much cheaper than writing lines one by one
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+
+            await self._run_in_executor(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        output = []
+        for job, phase, lines in batch:
+            prefix = "[{} {}] ".format(job.tag, phase)
+            text = []
+            for line in lines:
+                line = line.decode("utf-8", errors="replace").rstrip("\r")
+                text.append(prefix + line)
+
+            if not self._live:
+                output.extend(text)
+            if self._log_dir is not None:
+                self._write_log(job, text)
+
+        if output:
+            self._stream.write("\n".join(output) + "\n")
+            self._stream.flush()
+
+    def _write_log(self, job, text):
+        job._log_buffer.extend(text)
+        job._log_buffered += sum([len(line) for line in text])
+
+        if job._log_buffered >= _LOG_BUFFER_SIZE:
+            self._flush_log(job)
+
+    def _flush_log(self, job):
+        if job._log is None:
+            name = job.tag.replace("/", "_").replace(" ", "-") + ".log"
+            job._log = open(Path(self._log_dir, name), "w")
+
+        if job._log_buffer:
+            job._log.write("\n".join(job._log_buffer) + "\n")
+        job._log_buffer = []
+        job._log_buffered = 0
+
+    def _close_logs(self):
+        if self._log_dir is None:
+            return
+
+        for job in self._jobs:
+            if job._log_buffer or job._log is not None:
+                self._flush_log(job)
+                job._log.close()
+
+    async def _update_status(self):
+        while True:
+            await self._run_in_executor(self._draw_status)
+            await asyncio.sleep(_STATUS_INTERVAL)
+
+    def _format_status(self, width):
+        now = time.monotonic()
+
+        tag_width = max([len(job.tag) for job in self._jobs] + [3])
+        phase_width = max([len(job.phase or "") for job in self._jobs] + [5])
+
+        lines = []
+        for job in self._jobs:
+            if job.start is None:
+                elapsed = ""
+            else:
+                seconds = int((job.end or now) - job.start)
+                elapsed = "{}:{:02}".format(seconds // 60, seconds % 60)
+
+            line = "{:<{}}  {:<{}}  {:<7}  {:>7}  {:>6}  {}".format(
+                job.tag, tag_width,
+                job.phase or "", phase_width,
+                job.state,
+                job.lines,
+                elapsed,
+                job.last_line if job.state == "running" else "",
+            )
+            lines.append(line[:width - 1])
+
+        return lines
+
+    def _draw_status(self):
+        width = shutil.get_terminal_size().columns
+        lines = self._format_status(width)
+
+        # Go back to where the table was drawn last time, and replace it
+        if self._status_lines:
+            self._stream.write("\x1b[{}F".format(self._status_lines))
+        self._stream.write("\x1b[J")
+        self._stream.write("".join([line + "\n" for line in lines]))
+        self._stream.flush()
+
+        self._status_lines = len(lines)
@@ -4,30 +4,35 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-import yaml
 from pathlib import Path
 
-from lcitool import util
+from lcitool import cache, timings, util
 
 
 class Projects:
 
-    def __init__(self):
-        base = Path(util.get_base(), "ansible")
+    def __init__(self, base=None):
+        """
+        Initialize an instance
 
-        mappings_path = Path(base, "vars", "mappings.yml")
+        :param base: directory containing the ansible/ tree to read the
+                     projects from (optional, defaults to the one
+                     lcitool is part of)
+        """
 
-        try:
-            with open(mappings_path, "r") as infile:
-                mappings = yaml.safe_load(infile)
-                self._mappings = mappings["mappings"]
-                self._pypi_mappings = mappings["pypi_mappings"]
-                self._cpan_mappings = mappings["cpan_mappings"]
-        except Exception as ex:
-            raise Exception("Can't load mappings: {}".format(ex))
+        if base is None:
+            base = util.get_base()
+        base = Path(base, "ansible")
+        self._base = base
+
+        self._mappings = None
+        self._pypi_mappings = None
+        self._cpan_mappings = None
 
         source = Path(base, "vars", "projects")
 
+        # Only the list of projects is built here: mappings and packages
+        # are loaded the first time they're needed
         self._packages = {}
         for item in source.iterdir():
             yaml_path = Path(source, item)
@@ -36,18 +41,25 @@ class Projects:
             if yaml_path.suffix != ".yml":
                 continue
 
-            project = item.stem
+            self._packages[item.stem] = None
 
-            try:
-                with open(yaml_path, "r") as infile:
-                    packages = yaml.safe_load(infile)
-                    self._packages[project] = packages["packages"]
-            except Exception as ex:
-                raise Exception(
-                    "Can't load packages for '{}': {}".format(project, ex))
+        # Sorted once here rather than every time a pattern is expanded
+        self._names = tuple(sorted(self._packages))
+
+    def _load_mappings(self):
+        mappings_path = self.get_mappings_path()
+
+        try:
+            with timings.phase("mappings load", "projects"):
+                mappings = cache.load_yaml(mappings_path)
+            self._mappings = mappings["mappings"]
+            self._pypi_mappings = mappings["pypi_mappings"]
+            self._cpan_mappings = mappings["cpan_mappings"]
+        except Exception as ex:
+            raise Exception("Can't load mappings: {}".format(ex))
 
     def expand_pattern(self, pattern):
-        projects = util.expand_pattern(pattern, self._packages, "project")
+        projects = util.expand_pattern(pattern, self._names, "project")
 
         # Some projects are internal implementation details and should
         # not be exposed to the user
@@ -57,14 +69,35 @@ class Projects:
 
         return projects
 
+    def get_mappings_path(self):
+        return Path(self._base, "vars", "mappings.yml")
+
     def get_mappings(self):
+        if self._mappings is None:
+            self._load_mappings()
         return self._mappings
 
     def get_pypi_mappings(self):
+        if self._pypi_mappings is None:
+            self._load_mappings()
         return self._pypi_mappings
 
     def get_cpan_mappings(self):
+        if self._cpan_mappings is None:
+            self._load_mappings()
         return self._cpan_mappings
 
     def get_packages(self, project):
-        return self._packages[project]
+        packages = self._packages[project]
+        if packages is None:
+            yaml_path = Path(self._base, "vars", "projects", project + ".yml")
+
+            try:
+                with timings.phase("packages load", "projects"):
+                    packages = cache.load_yaml(yaml_path)["packages"]
+            except Exception as ex:
+                raise Exception(
+                    "Can't load packages for '{}': {}".format(project, ex))
+            self._packages[project] = packages
+
+        return packages
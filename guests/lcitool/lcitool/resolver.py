@@ -0,0 +1,251 @@
+# resolver.py - module containing the package mapping resolver
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from lcitool import cache, timings, util
+
+
+class PackageResolver:
+    """
+    Resolves abstract package names to concrete ones.
+
+    For every (OS name, OS version, packaging format, native arch, cross
+    arch) combination a flat table mapping each abstract package name to
+    its native, foreign, PyPI and CPAN counterparts is built the first
+    time it's needed; after that, resolving a package is a single dict
+    lookup. A single instance is meant to be shared by all formatters.
+
+    Tables compiled by 'lcitool check' are used instead of building them
+    from scratch whenever possible, in which case the mappings don't need
+    to be loaded at all.
+    """
+
+    def __init__(self, projects):
+        """
+        Initialize an instance
+
+        :param projects: instance of the Projects class
+        """
+
+        self._projects = projects
+        self._tables = {}
+
+    @staticmethod
+    def _get_keys(facts, cross_arch, native_arch):
+        base_keys = [
+            "default",
+            facts["packaging"]["format"],
+            facts["os"]["name"],
+            facts["os"]["name"] + facts["os"]["version"],
+        ]
+        cross_keys = []
+        cross_policy_keys = []
+
+        if cross_arch:
+            keys = base_keys
+            if facts["packaging"]["format"] == "deb":
+                # For Debian-based distros, the name of the foreign package
+                # is usually the same as the native package, but there might
+                # be architecture-specific overrides, so we have to look both
+                # at the neutral keys and at the specific ones
+                cross_keys = base_keys + [cross_arch + "-" + k for k in base_keys]
+            elif facts["packaging"]["format"] == "rpm":
+                # For RPM-based distros, the name of the foreign package is
+                # usually very different from the native one, so we should
+                # only look at the keys that are specific to cross-building
+                # because otherwise we'd also pick up a bunch of native
+                # packages we don't actually need
+                cross_keys = [cross_arch + "-" + k for k in base_keys]
+            cross_policy_keys = ["cross-policy-" + k for k in base_keys]
+        else:
+            keys = base_keys + [native_arch + "-" + k for k in base_keys]
+
+        return keys, cross_keys, cross_policy_keys
+
+    def _build_table(self, facts, cross_arch, native_arch):
+        mappings = self._projects.get_mappings()
+        pypi_mappings = self._projects.get_pypi_mappings()
+        cpan_mappings = self._projects.get_cpan_mappings()
+
+        keys, cross_keys, cross_policy_keys = self._get_keys(facts,
+                                                             cross_arch,
+                                                             native_arch)
+
+        table = {}
+        for package in set(mappings) | set(pypi_mappings) | set(cpan_mappings):
+            cross_policy = "native"
+            native = None
+            foreign = None
+            pypi = None
+            cpan = None
+
+            if package in mappings:
+                mapping = mappings[package]
+
+                for key in cross_policy_keys:
+                    if key in mapping:
+                        cross_policy = mapping[key]
+
+                if cross_policy not in ["native", "foreign", "skip"]:
+                    # This is only an error if the package is actually
+                    # needed, so instead of raising right away we store
+                    # the message in place of the mapping
+                    table[package] = (
+                        "Unexpected cross arch policy {} for {}".format
+                        (cross_policy, package))
+                    continue
+
+                if cross_arch and cross_policy == "foreign":
+                    lookup_keys = cross_keys
+                else:
+                    lookup_keys = keys
+
+                for key in lookup_keys:
+                    if key in mapping:
+                        native = mapping[key]
+
+            if package in pypi_mappings:
+                pypi = pypi_mappings[package].get("default")
+
+            if package in cpan_mappings:
+                cpan = cpan_mappings[package].get("default")
+
+            # Native packages always take precedence over PyPI and CPAN
+            if native is not None:
+                pypi = None
+                cpan = None
+
+                if cross_policy == "foreign":
+                    foreign = native
+                if cross_policy in ["skip", "foreign"]:
+                    native = None
+
+            table[package] = (native, foreign, pypi, cpan)
+
+        return table
+
+    @staticmethod
+    def _get_table_key(facts, cross_arch, native_arch):
+        return (
+            facts["os"]["name"],
+            facts["os"]["version"],
+            facts["packaging"]["format"],
+            native_arch,
+            cross_arch,
+        )
+
+    def _get_artifact_name(self, table_key):
+        mappings_path = self._projects.get_mappings_path()
+        digest = util.get_digest([mappings_path.as_posix(), table_key])
+        return "table-" + digest
+
+    def _get_table(self, facts, cross_arch, native_arch):
+        table_key = self._get_table_key(facts, cross_arch, native_arch)
+
+        try:
+            return self._tables[table_key]
+        except KeyError:
+            pass
+
+        table = cache.load_artifact(self._get_artifact_name(table_key),
+                                    [self._projects.get_mappings_path()])
+        if table is None:
+            with timings.phase("build table", "resolve"):
+                table = self._build_table(facts, cross_arch, native_arch)
+
+        self._tables[table_key] = table
+        return table
+
+    def compile_table(self, facts, cross_arch, native_arch):
+        """
+        Builds the table for a combination and stores it in the cache.
+
+        This should only be done once the mappings have been validated.
+
+        :param facts: facts of the host, as returned by Inventory
+        :param cross_arch: target architecture, or None for native builds
+        :param native_arch: architecture the packages are installed on
+        """
+
+        table_key = self._get_table_key(facts, cross_arch, native_arch)
+        table = self._build_table(facts, cross_arch, native_arch)
+
+        cache.save_artifact(self._get_artifact_name(table_key),
+                            [self._projects.get_mappings_path()],
+                            table)
+        self._tables[table_key] = table
+
+    def _resolve_packages(self, table, projects):
+        pkgs = {}
+        cross_pkgs = {}
+        pypi_pkgs = {}
+        cpan_pkgs = {}
+
+        for project in projects:
+            for package in self._projects.get_packages(project):
+                try:
+                    entry = table[package]
+                except KeyError:
+                    raise Exception(
+                        "No mapping defined for {}".format(package)
+                    )
+
+                if isinstance(entry, str):
+                    raise Exception(entry)
+
+                native, foreign, pypi, cpan = entry
+
+                if native is not None:
+                    pkgs[package] = native
+                if foreign is not None:
+                    cross_pkgs[package] = foreign
+                if pypi is not None:
+                    pypi_pkgs[package] = pypi
+                if cpan is not None:
+                    cpan_pkgs[package] = cpan
+
+        return pkgs, cross_pkgs, pypi_pkgs, cpan_pkgs
+
+    def resolve(self, facts, selected_projects, cross_arch):
+        """
+        Resolves the packages needed by a list of projects on a host.
+
+        The base project is always included, since the standard machinery
+        hides it as an implementation detail.
+
+        :param facts: facts of the host, as returned by Inventory
+        :param selected_projects: list of project names
+        :param cross_arch: target architecture, or None for native builds
+        :returns: tuple of four dicts (native, foreign, PyPI and CPAN
+                  packages), each mapping abstract package names to
+                  concrete ones
+        """
+
+        with timings.phase("resolve", "resolve"):
+            table = self._get_table(facts, cross_arch, util.get_native_arch())
+
+            return self._resolve_packages(table, selected_projects + ["base"])
+
+    def resolve_project(self, facts, project, arch):
+        """
+        Resolves the packages needed by a single project on a guest.
+
+        Unlike resolve(), this doesn't include the base project and uses
+        the architecture of the guest rather than the one lcitool is
+        running on.
+
+        :param facts: facts of the host, as returned by Inventory
+        :param project: project name
+        :param arch: architecture of the guest
+        :returns: tuple of three dicts (native, PyPI and CPAN packages),
+                  each mapping abstract package names to concrete ones
+        """
+
+        with timings.phase("resolve", "resolve"):
+            table = self._get_table(facts, None, arch)
+
+            pkgs, _, pypi_pkgs, cpan_pkgs = self._resolve_packages(table,
+                                                                   [project])
+        return pkgs, pypi_pkgs, cpan_pkgs
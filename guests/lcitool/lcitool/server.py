@@ -0,0 +1,215 @@
+# server.py - module containing the lcitool server
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+from lcitool import util
+from lcitool.client import get_socket_path
+from lcitool.formatters import DockerfileFormatter, VariablesFormatter
+from lcitool.inventory import Inventory
+from lcitool.projects import Projects
+from lcitool.resolver import PackageResolver
+
+# Files and directories under ansible/ the inventory and the projects
+# are loaded from: any change to them causes all data to be reloaded
+_WATCHED = [
+    "ansible.cfg",
+    "inventory",
+    "group_vars",
+    "host_vars",
+    "vars",
+]
+
+# Arguments accepted for each action, along with their default values
+_ACTIONS = {
+    "variables": {
+        "hosts": None,
+        "projects": None,
+        "cross_arch": None,
+        "fingerprint": False,
+        "format": "shell",
+    },
+    "dockerfile": {
+        "hosts": None,
+        "projects": None,
+        "cross_arch": None,
+        "layers": None,
+        "buildkit": False,
+        "fingerprint": False,
+        "batch": False,
+    },
+}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # Clients can send as many requests as they want over a single
+        # connection, one per line
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.lcitool.handle(request)
+            except Exception as ex:
+                response = {"error": str(ex)}
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Server:
+    """
+    Answers 'variables' and 'dockerfile' requests over a Unix socket.
+
+    Inventory, projects and the package resolver are kept in memory
+    between requests, so that answering one only requires formatting
+    the output. They're thrown away and loaded again whenever any of
+    the files they're based on changes. See the Client class for a
+    description of the protocol.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._formatters = None
+
+    @staticmethod
+    def _get_signature():
+        base = Path(util.get_base(), "ansible")
+
+        signature = []
+        for name in _WATCHED:
+            for root, dirs, files in os.walk(Path(base, name)):
+                dirs.sort()
+                for item in sorted(files):
+                    stat = os.stat(Path(root, item))
+                    signature.append((root, item,
+                                      stat.st_mtime_ns, stat.st_size))
+
+            # os.walk() doesn't return anything for regular files
+            path = Path(base, name)
+            if path.is_file():
+                stat = path.stat()
+                signature.append((name, stat.st_mtime_ns, stat.st_size))
+
+        return signature
+
+    def _get_formatters(self):
+        signature = self._get_signature()
+
+        if signature != self._signature:
+            inventory = Inventory()
+            projects = Projects()
+            resolver = PackageResolver(projects)
+
+            # Everything is loaded right away rather than on demand, so
+            # that requests don't have to pay for it
+            for host in inventory.expand_pattern("all"):
+                inventory.get_facts(host)
+            projects.get_mappings()
+            for project in projects.expand_pattern("all"):
+                projects.get_packages(project)
+
+            self._formatters = {
+                "variables": VariablesFormatter(projects, inventory,
+                                                resolver),
+                "dockerfile": DockerfileFormatter(projects, inventory,
+                                                  resolver),
+            }
+            self._signature = signature
+
+        return self._formatters
+
+    def handle(self, request):
+        """
+        Handles a single request.
+
+        :param request: the request, as a dictionary
+        :returns: the response, as a dictionary
+        """
+
+        action = request.get("action")
+        if action not in _ACTIONS:
+            raise Exception("Unknown action '{}'".format(action))
+
+        args = argparse.Namespace(**_ACTIONS[action])
+        for key, value in request.items():
+            if key == "action":
+                continue
+            if key not in _ACTIONS[action]:
+                raise Exception(
+                    "Unknown argument '{}' for '{}'".format(key, action))
+            setattr(args, key, value)
+
+        # Formatters are not meant to be used concurrently
+        with self._lock:
+            formatter = self._get_formatters()[action]
+
+            # Messages about skipped combinations are sent back to the
+            # client rather than ending up on our own standard error
+            skipped = []
+            if args.fingerprint:
+                response = {"output": formatter.fingerprint(args)}
+            elif action == "dockerfile" and args.batch:
+                response = {"files": dict(formatter.format_batch(args,
+                                                                 skipped))}
+            elif action == "dockerfile":
+                if args.layers is not None:
+                    raise Exception("Layering requires batch mode")
+                response = {"output": formatter.format(args)}
+            else:
+                response = {"output": formatter.format(args, skipped)}
+
+        response["skipped"] = skipped
+        return response
+
+    def serve(self, socket_path=None):
+        """
+        Listens for requests until interrupted.
+
+        :param socket_path: path of the socket to listen on (optional)
+        """
+
+        if socket_path is None:
+            socket_path = get_socket_path()
+        socket_path = Path(socket_path)
+
+        # Load everything before accepting connections, so that the first
+        # request is as fast as the following ones
+        self._get_formatters()
+
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+        # Make sure the socket is removed when we're asked to terminate
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        with _UnixServer(str(socket_path), _Handler) as server:
+            server.lcitool = self
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                # The socket might have been removed while we were running
+                try:
+                    socket_path.unlink()
+                except FileNotFoundError:
+                    pass
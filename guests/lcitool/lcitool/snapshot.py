@@ -0,0 +1,226 @@
+# snapshot.py - module containing snapshots of resolved package sets
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from pathlib import Path
+
+from lcitool import cache, util
+from lcitool.formatters import VariablesFormatter
+from lcitool.inventory import Inventory
+from lcitool.projects import Projects
+from lcitool.resolver import PackageResolver
+
+_PACKAGE_KEYS = ["pkgs", "cross_pkgs", "pypi_pkgs", "cpan_pkgs"]
+
+
+def get_name(host, project, cross_arch):
+    """
+    Returns the name identifying a combination, which is the same one
+    used for the Dockerfiles generated in batch mode.
+    """
+
+    name = "{}-{}".format(host, project)
+    if cross_arch:
+        name += "-cross-{}".format(cross_arch)
+    return name
+
+
+def _extract(tar, path):
+    # The archive comes from git, but a revision can contain anything:
+    # make sure nothing ends up outside of the destination directory.
+    # Python versions which have extraction filters take care of that
+    # by themselves, older ones need us to check each member instead
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(path, filter="data")
+        return
+
+    for member in tar.getmembers():
+        names = [member.name]
+        if member.issym():
+            names.append(os.path.join(os.path.dirname(member.name),
+                                      member.linkname))
+        elif member.islnk():
+            names.append(member.linkname)
+
+        for name in names:
+            if (os.path.isabs(name) or
+                    os.path.normpath(name).split(os.sep)[0] == ".."):
+                raise Exception(
+                    "Invalid path in archive: {}".format(member.name))
+        if not (member.isfile() or member.isdir() or
+                member.issym() or member.islnk()):
+            raise Exception(
+                "Invalid file type in archive: {}".format(member.name))
+
+    tar.extractall(path)
+
+
+def get_tree(revision):
+    """
+    Makes the ansible/ tree at a git revision available on disk.
+
+    Since revisions are immutable, the tree is extracted only once under
+    $XDG_CACHE_HOME/lcitool and reused by later calls.
+
+    :param revision: any git revision lcitool's repository knows about
+    :returns: path to a directory containing the ansible/ tree
+    """
+
+    base = util.get_base()
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--verify", "-q", revision + "^{commit}"],
+            cwd=base,
+            universal_newlines=True,
+        ).strip()
+        toplevel, prefix = subprocess.check_output(
+            ["git", "rev-parse", "--show-toplevel", "--show-prefix"],
+            cwd=base,
+            universal_newlines=True,
+        ).splitlines()
+    except Exception:
+        raise Exception("Invalid git revision '{}'".format(revision))
+
+    tree = Path(cache.get_cache_dir(), "trees", commit)
+    if tree.exists():
+        return tree
+
+    try:
+        archive = subprocess.check_output(
+            ["git", "archive", "--format=tar",
+             "{}:{}ansible".format(commit, prefix)],
+            cwd=toplevel,
+            stderr=subprocess.DEVNULL,
+        )
+    except Exception as ex:
+        raise Exception(
+            "Can't export revision '{}': {}".format(revision, ex))
+
+    # Extract into a temporary directory first and rename it afterwards,
+    # so that an interrupted run doesn't leave a partial tree behind
+    tree.parent.mkdir(parents=True, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=tree.parent, prefix=commit)
+    try:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            _extract(tar, Path(tmpdir, "ansible"))
+        os.replace(tmpdir, tree)
+    except Exception:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if not tree.exists():
+            raise
+
+    return tree
+
+
+def take(base=None):
+    """
+    Resolves the packages for every combination of host, project and
+    cross architecture.
+
+    Combinations which are not supported, eg. cross compiling on a
+    distro which can't do that, are skipped.
+
+    :param base: directory containing the ansible/ tree to use (optional,
+                 defaults to the one lcitool is part of)
+    :returns: dictionary mapping the name of each combination to its
+              resolved package sets
+    """
+
+    inventory = Inventory(base)
+    projects = Projects(base)
+    resolver = PackageResolver(projects)
+    formatter = VariablesFormatter(projects, inventory, resolver)
+
+    hosts = inventory.expand_pattern("all")
+    selected_projects = projects.expand_pattern("all")
+    native_arch = util.get_native_arch()
+
+    combinations = {}
+    for host in hosts:
+        facts = inventory.get_facts(host)
+
+        for cross_arch in [None] + util.get_arches():
+            if formatter._generator_get_unsupported(host, facts,
+                                                    cross_arch) is not None:
+                continue
+
+            for project in selected_projects:
+                resolved = resolver.resolve(facts, [project], cross_arch)
+
+                packages = {}
+                for key, pkgs in zip(_PACKAGE_KEYS, resolved):
+                    packages[key] = sorted(set(pkgs.values()))
+
+                combinations[get_name(host, project, cross_arch)] = packages
+
+    return {
+        "native_arch": native_arch,
+        "combinations": combinations,
+    }
+
+
+def load(path):
+    try:
+        with open(path, "r") as fp:
+            snapshot = json.load(fp)
+        for key in ["native_arch", "combinations"]:
+            if key not in snapshot:
+                raise Exception("Missing '{}' key".format(key))
+    except Exception as ex:
+        raise Exception("Invalid snapshot file ({}): {}".format(path, ex))
+
+    return snapshot
+
+
+def save(snapshot, path):
+    with open(path, "w") as fp:
+        json.dump(snapshot, fp, indent=2, sort_keys=True)
+
+
+def compare(old, new):
+    """
+    Compares two snapshots.
+
+    :param old: snapshot, as returned by take() or load()
+    :param new: snapshot, as returned by take() or load()
+    :returns: sorted list of (name, changes) tuples, one per combination
+              that was added, removed or resolves to different packages;
+              changes is a list of the affected package sets, or a list
+              containing just "added" or "removed"
+    """
+
+    if old["native_arch"] != new["native_arch"]:
+        raise Exception(
+            "Can't compare snapshots taken on {} and {}".format(
+                old["native_arch"], new["native_arch"]))
+
+    old_combinations = old["combinations"]
+    new_combinations = new["combinations"]
+
+    diff = []
+    for name in sorted(set(old_combinations) | set(new_combinations)):
+        if name not in old_combinations:
+            diff.append((name, ["added"]))
+            continue
+        if name not in new_combinations:
+            diff.append((name, ["removed"]))
+            continue
+
+        changes = []
+        for key in _PACKAGE_KEYS:
+            if old_combinations[name][key] != new_combinations[name][key]:
+                changes.append(key)
+        if changes:
+            diff.append((name, changes))
+
+    return diff
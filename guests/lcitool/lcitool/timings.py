@@ -0,0 +1,110 @@
+# timings.py - module containing the timing instrumentation for lcitool
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import contextlib
+import os
+import threading
+import time
+
+# Phases that have completed so far, or None if recording is disabled;
+# each one is a (name, category, start, duration, thread) tuple
+_phases = None
+_origin = None
+
+
+def enable():
+    """
+    Starts recording the time spent in each phase.
+
+    Recording is disabled by default, in which case phase() costs next
+    to nothing.
+    """
+
+    global _phases, _origin
+
+    _phases = []
+    _origin = time.perf_counter()
+
+
+@contextlib.contextmanager
+def phase(name, category="lcitool"):
+    """
+    Records the wall time spent running the body of a with statement.
+
+    :param name: name of the phase, eg. "inventory load"
+    :param category: kind of phase, used to group phases in the report
+    """
+
+    if _phases is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, category, start, time.perf_counter() - start,
+                        threading.get_ident()))
+
+
+def report(stream):
+    """
+    Writes a summary of the recorded phases.
+
+    Phases with the same name are merged, and times are inclusive of any
+    phase nested inside them.
+
+    :param stream: file object to write the summary to
+    """
+
+    totals = {}
+    for name, category, start, duration, thread in sorted(_phases,
+                                                          key=lambda p: p[2]):
+        key = (category, name)
+        if key not in totals:
+            totals[key] = [0, 0.0]
+        totals[key][0] += 1
+        totals[key][1] += duration
+
+    stream.write("{:<12} {:<40} {:>6} {:>11}\n".format(
+        "CATEGORY", "PHASE", "COUNT", "WALL TIME"))
+    for (category, name), (count, total) in totals.items():
+        stream.write("{:<12} {:<40} {:>6} {:>8.1f} ms\n".format(
+            category, name, count, total * 1000))
+
+
+def write_trace(path):
+    """
+    Writes the recorded phases in Chrome's trace event format.
+
+    The resulting file can be loaded in chrome://tracing, Perfetto and
+    similar tools.
+
+    :param path: path of the file to write
+    """
+
+    import json
+
+    pid = os.getpid()
+    threads = {}
+
+    events = []
+    for name, category, start, duration, thread in _phases:
+        # Thread identifiers are huge numbers, which trace viewers don't
+        # display very well
+        tid = threads.setdefault(thread, len(threads))
+        events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - _origin) * 1000000),
+            "dur": round(duration * 1000000),
+            "pid": pid,
+            "tid": tid,
+        })
+
+    with open(path, "w") as fp:
+        json.dump({"traceEvents": events}, fp)
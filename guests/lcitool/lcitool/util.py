@@ -5,42 +5,111 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import fnmatch
-import platform
+import functools
+import re
 
 from pathlib import Path
 
+# Modules only some commands need are imported by the functions using
+# them, so that the others start fast
+
 
 def get_base():
     return Path(__file__).parents[1].resolve().as_posix()
 
 
-def expand_pattern(pattern, source, name):
-    if pattern is None:
-        raise Exception("Missing {} list".format(name))
+def get_digest(data):
+    import hashlib
+    import json
 
-    if pattern == "all":
-        pattern = "*"
+    # Keys are sorted so that the result doesn't depend on the order in
+    # which dicts have been populated
+    serialized = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
 
-    # This works correctly for single items as well as more complex
-    # cases such as explicit lists, glob patterns and any combination
-    # of the above
-    matches = []
+
+def yaml_load(stream):
+    # PyYAML takes a while to import and most of the time all data comes
+    # from the on-disk cache anyway, so only import it when needed
+    import yaml
+
+    # The libyaml-based loader is several times faster than the pure Python
+    # one, but it's only available if PyYAML was built against libyaml
+    try:
+        loader = yaml.CSafeLoader
+    except AttributeError:
+        loader = yaml.SafeLoader
+
+    return yaml.load(stream, Loader=loader)
+
+
+@functools.lru_cache(maxsize=256)
+def _expand_pattern(pattern, names, name):
+    exact = set()
+    globs = []
     for partial_pattern in pattern.split(","):
+        if any(c in partial_pattern for c in "*?["):
+            globs.append(partial_pattern)
+        else:
+            exact.add(partial_pattern)
 
-        partial_matches = []
-        for item in source:
-            if fnmatch.fnmatch(item, partial_pattern):
-                partial_matches.append(item)
+    # All glob patterns are compiled into a single regular expression,
+    # so that we only need to go through the names once
+    regex = None
+    if globs:
+        regex = re.compile("|".join(fnmatch.translate(g) for g in globs))
 
-        if not partial_matches:
+    matches = []
+    for item in names:
+        if item in exact or (regex is not None and regex.match(item)):
+            matches.append(item)
+
+    # Every part of the pattern has to match something: for globs, it's
+    # enough to look at what the combined regular expression matched
+    found = set(matches)
+    for partial_pattern in exact:
+        if partial_pattern not in found:
+            raise Exception("Invalid {} list '{}'".format(name, pattern))
+    for partial_pattern in globs:
+        partial_regex = re.compile(fnmatch.translate(partial_pattern))
+        if not any(partial_regex.match(item) for item in matches):
             raise Exception("Invalid {} list '{}'".format(name, pattern))
 
-        matches.extend(partial_matches)
+    return tuple(matches)
 
-    return sorted(set(matches))
+
+def expand_pattern(pattern, source, name):
+    """
+    Expands a pattern into the list of names it refers to.
+
+    This works correctly for single items as well as more complex cases
+    such as explicit lists, glob patterns and any combination of the
+    above. Results are cached, so expanding the same pattern again is
+    essentially free.
+
+    :param pattern: comma-separated list of names and glob patterns, or
+                    "all"
+    :param source: names to match the pattern against, ideally as a
+                   sorted tuple which can be used as cache key as-is
+    :param name: kind of names, used in error messages
+    :returns: sorted list of matching names
+    """
+
+    if pattern is None:
+        raise Exception("Missing {} list".format(name))
+
+    if pattern == "all":
+        pattern = "*"
+
+    if not isinstance(source, tuple):
+        source = tuple(sorted(source))
+
+    return list(_expand_pattern(pattern, source, name))
 
 
 def get_native_arch():
+    import platform
+
     # Same canonicalization as libvirt virArchFromHost
     arch = platform.machine()
     if arch in ["i386", "i486", "i586"]:
@@ -50,6 +119,28 @@ def get_native_arch():
     return arch
 
 
+def get_arches():
+    """
+    Returns the names of all architectures lcitool knows about, which
+    can be used both as native and as cross compilation targets.
+    """
+
+    return [
+        "aarch64",
+        "armv6l",
+        "armv7l",
+        "i686",
+        "mingw32",
+        "mingw64",
+        "mips",
+        "mipsel",
+        "mips64el",
+        "ppc64le",
+        "s390x",
+        "x86_64",
+    ]
+
+
 def native_arch_to_abi(native_arch):
     archmap = {
         "aarch64": "aarch64-linux-gnu",
@@ -0,0 +1,173 @@
+# test_bootcache.py - module containing tests for the install kernel cache
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import functools
+import gzip
+import hashlib
+import http.server
+import threading
+from pathlib import Path
+
+import pytest
+
+from lcitool import bootcache
+
+KERNEL = b"kernel" * 1000
+INITRD = b"initrd" * 1000
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+    def send_response(self, code, message=None):
+        self.server.responses.append((self.path, code))
+        super().send_response(code, message)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_tree(tree, kernel=KERNEL, initrd=INITRD, treeinfo=True):
+    pxeboot = Path(tree, "images", "pxeboot")
+    pxeboot.mkdir(parents=True, exist_ok=True)
+    Path(pxeboot, "vmlinuz").write_bytes(kernel)
+    Path(pxeboot, "initrd.img").write_bytes(initrd)
+
+    if treeinfo:
+        Path(tree, ".treeinfo").write_text(
+            "[checksums]\n"
+            "images/pxeboot/vmlinuz = sha256:{}\n"
+            "images/pxeboot/initrd.img = sha256:{}\n".format(
+                hashlib.sha256(kernel).hexdigest(),
+                hashlib.sha256(initrd).hexdigest(),
+            )
+        )
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", Path(tmp_path, "cache").as_posix())
+
+    tree = Path(tmp_path, "tree")
+    tree.mkdir()
+
+    handler = functools.partial(Handler, directory=tree.as_posix())
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.requests = []
+    httpd.responses = []
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd, tree, "http://127.0.0.1:{}/".format(httpd.server_port)
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def downloads(httpd):
+    return [r for r in httpd.requests if r.startswith("/images/")]
+
+
+def test_prefetch(server):
+    httpd, tree, url = server
+    write_tree(tree)
+
+    kernel, initrd = bootcache.prefetch(url, "Fedora", "x86_64")
+
+    assert kernel.read_bytes() == KERNEL
+    assert initrd.read_bytes() == INITRD
+    assert kernel.name == hashlib.sha256(KERNEL).hexdigest()
+    assert len(downloads(httpd)) == 2
+
+    # The checksums in .treeinfo tell us the files are current
+    assert bootcache.prefetch(url, "Fedora", "x86_64") == (kernel, initrd)
+    assert len(downloads(httpd)) == 2
+
+
+def test_prefetch_changed(server):
+    httpd, tree, url = server
+    write_tree(tree)
+    old_kernel, _ = bootcache.prefetch(url, "Fedora", "x86_64")
+
+    write_tree(tree, kernel=b"new kernel")
+    kernel, initrd = bootcache.prefetch(url, "Fedora", "x86_64")
+
+    assert kernel != old_kernel
+    assert kernel.read_bytes() == b"new kernel"
+    assert downloads(httpd).count("/images/pxeboot/vmlinuz") == 2
+    assert downloads(httpd).count("/images/pxeboot/initrd.img") == 1
+
+
+def test_prefetch_checksum_mismatch(server):
+    httpd, tree, url = server
+    write_tree(tree)
+    Path(tree, "images", "pxeboot", "vmlinuz").write_bytes(b"corrupted")
+
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        bootcache.prefetch(url, "Fedora", "x86_64")
+
+    # Nothing is left behind
+    objects = Path(bootcache._get_cache_dir(), "objects")
+    assert list(objects.iterdir()) == []
+
+
+def test_prefetch_no_checksums(server):
+    httpd, tree, url = server
+    write_tree(tree, treeinfo=False)
+
+    kernel, initrd = bootcache.prefetch(url, "Fedora", "x86_64")
+    assert kernel.read_bytes() == KERNEL
+
+    # Without checksums the server is asked whether the files changed,
+    # and they're not downloaded again if they haven't
+    assert bootcache.prefetch(url, "Fedora", "x86_64") == (kernel, initrd)
+    assert httpd.responses[-2:] == [
+        ("/images/pxeboot/vmlinuz", 304),
+        ("/images/pxeboot/initrd.img", 304),
+    ]
+
+
+def test_prefetch_unknown_os(server):
+    httpd, tree, url = server
+
+    assert bootcache.prefetch(url, "FreeBSD", "x86_64") is None
+    assert httpd.requests == []
+
+
+def read_cpio(data):
+    files = {}
+    while True:
+        assert data[:6] == b"070701"
+        fields = [int(data[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+        size, namesize = fields[6], fields[11]
+
+        offset = 110 + namesize
+        name = data[110:offset - 1].decode("utf-8")
+        offset += -offset % 4
+        content = data[offset:offset + size]
+        offset += size
+        offset += -offset % 4
+
+        if name == "TRAILER!!!":
+            return files
+        files[name] = content
+        data = data[offset:]
+
+
+def test_inject(tmp_path):
+    initrd = Path(tmp_path, "initrd")
+    initrd.write_bytes(b"12345")
+    injected = Path(tmp_path, "injected")
+
+    bootcache.inject(initrd, {"ks.cfg": "text\n"}, injected)
+
+    data = injected.read_bytes()
+    assert data[:8] == b"12345\0\0\0"
+    assert read_cpio(gzip.decompress(data[8:])) == {"ks.cfg": b"text\n"}
@@ -0,0 +1,53 @@
+# test_build.py - module containing tests for the build command
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from lcitool.application import Application
+
+
+@pytest.fixture
+def remote(tmp_path):
+    if shutil.which("git") is None:
+        pytest.skip("git not available")
+
+    def git(*args):
+        return subprocess.check_output(
+            ["git", "-C", tmp_path.as_posix(),
+             "-c", "user.name=test", "-c", "user.email=test@example.com"] +
+            list(args),
+            universal_newlines=True,
+        ).strip()
+
+    git("init", "-q")
+    commits = {}
+    for branch in ["foo/master", "master", "release"]:
+        git("checkout", "-q", "-B", branch)
+        git("commit", "-q", "--allow-empty", "-m", branch)
+        commits[branch] = git("rev-parse", "HEAD")
+    # A tag named like a branch but pointing somewhere else
+    git("tag", "master", commits["foo/master"])
+
+    return Path(tmp_path).as_uri(), commits
+
+
+def test_git_commit_exact_branch(remote):
+    url, commits = remote
+
+    # Neither 'refs/heads/foo/master' nor 'refs/tags/master' are picked
+    assert Application._get_git_commit(url, "master") == commits["master"]
+    assert Application._get_git_commit(url, "release") == commits["release"]
+
+
+def test_git_commit_missing_branch(remote):
+    url, commits = remote
+
+    with pytest.raises(Exception, match="Branch 'other' not found"):
+        Application._get_git_commit(url, "other")
@@ -0,0 +1,210 @@
+# test_golden.py - module containing tests for the golden image handling
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from lcitool import golden
+
+# Disk images created by the stand-in for qemu-img are text files which
+# contain the path of their backing file, if any
+FAKE_QEMU_IMG = """\
+import json, sys
+
+if sys.argv[1] != "info":
+    sys.exit(1)
+
+chain = []
+path = sys.argv[-1]
+while path:
+    try:
+        with open(path) as fp:
+            backing = fp.read().strip()
+    except OSError as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+    chain.append({"filename": path})
+    path = backing
+
+print(json.dumps(chain[0] if len(chain) == 1 else chain))
+"""
+
+# The stand-in for virsh knows about the guests stored as XML files in
+# the directory it lives in
+FAKE_VIRSH = """\
+import sys
+from pathlib import Path
+
+domains = Path(__file__).parent
+args = [a for a in sys.argv[1:] if a != "-q"]
+
+if args[0] == "list":
+    for domain in sorted(domains.glob("*.xml")):
+        print(domain.stem)
+elif args[0] == "dumpxml":
+    print(Path(domains, args[1] + ".xml").read_text())
+else:
+    sys.exit(1)
+"""
+
+DOMAIN_XML = """\
+<domain type="kvm">
+  <name>{name}</name>
+  <devices>
+    <disk type="file" device="disk">
+      <source file="{path}"/>
+    </disk>
+  </devices>
+</domain>
+"""
+
+
+def write_command(bin_dir, name, source):
+    path = Path(bin_dir, name)
+    path.write_text("#!{}\n{}".format(sys.executable, source))
+    path.chmod(0o755)
+
+
+@pytest.fixture(params=["stand-in", "qemu-img"])
+def env(request, tmp_path, monkeypatch):
+    bin_dir = Path(tmp_path, "bin")
+    bin_dir.mkdir()
+    pool_dir = Path(tmp_path, "pool")
+    pool_dir.mkdir()
+
+    write_command(bin_dir, "virsh", FAKE_VIRSH)
+
+    if request.param == "stand-in":
+        write_command(bin_dir, "qemu-img", FAKE_QEMU_IMG)
+
+        def create_image(path, backing=None):
+            Path(path).write_text(str(backing or ""))
+    else:
+        qemu_img = shutil.which("qemu-img")
+        if qemu_img is None:
+            pytest.skip("qemu-img not available")
+
+        def create_image(path, backing=None):
+            cmd = [qemu_img, "create", "-q", "-f", "qcow2"]
+            if backing is not None:
+                cmd += ["-F", "qcow2", "-b", str(backing)]
+            subprocess.check_call(cmd + [str(path), "1M"])
+
+    monkeypatch.setenv("PATH", bin_dir.as_posix() + os.pathsep +
+                       os.environ["PATH"])
+
+    def define_guest(name, path, xml=DOMAIN_XML):
+        Path(bin_dir, name + ".xml").write_text(xml.format(name=name,
+                                                           path=path))
+
+    return pool_dir, create_image, define_guest
+
+
+def golden_path(pool_dir, digest):
+    return golden.get_path(pool_dir, "lcitool-golden-fedora-32", digest * 12)
+
+
+def test_prune_removes_unused(env):
+    pool_dir, create_image, define_guest = env
+
+    old = golden_path(pool_dir, "a")
+    new = golden_path(pool_dir, "b")
+    create_image(old)
+    create_image(new)
+    create_image(Path(pool_dir, "guest.qcow2"), new)
+
+    removed = golden.prune(pool_dir, {"lcitool-golden-fedora-32": {new}})
+
+    assert removed == [old]
+    assert not old.exists()
+    assert new.exists()
+
+
+def test_prune_keeps_all_current(env):
+    pool_dir, create_image, define_guest = env
+
+    first = golden_path(pool_dir, "a")
+    second = golden_path(pool_dir, "b")
+    create_image(first)
+    create_image(second)
+
+    removed = golden.prune(pool_dir,
+                           {"lcitool-golden-fedora-32": {first, second}})
+
+    assert removed == []
+
+
+def test_prune_keeps_backing_of_any_pool_file(env):
+    pool_dir, create_image, define_guest = env
+
+    old = golden_path(pool_dir, "a")
+    new = golden_path(pool_dir, "b")
+    create_image(old)
+    create_image(new)
+    # Not named like a disk image, but based on the old golden image
+    create_image(Path(pool_dir, "guest.img"), old)
+
+    removed = golden.prune(pool_dir, {"lcitool-golden-fedora-32": {new}})
+
+    assert removed == []
+    assert old.exists()
+
+
+def test_prune_keeps_backing_of_guest_disks(env, tmp_path):
+    pool_dir, create_image, define_guest = env
+
+    old = golden_path(pool_dir, "a")
+    older = golden_path(pool_dir, "c")
+    new = golden_path(pool_dir, "b")
+    create_image(old)
+    create_image(older)
+    create_image(new)
+
+    # Guest disks stored outside of the pool, or golden images used as
+    # disks directly, are taken into account too
+    outside = Path(tmp_path, "outside.qcow2")
+    create_image(outside, old)
+    define_guest("outside", outside)
+    define_guest("direct", older)
+
+    removed = golden.prune(pool_dir, {"lcitool-golden-fedora-32": {new}})
+
+    assert removed == []
+
+
+def test_prune_ignores_other_files(env):
+    pool_dir, create_image, define_guest = env
+
+    new = golden_path(pool_dir, "b")
+    other = golden.get_path(pool_dir, "lcitool-golden-fedora-31", "a" * 12)
+    create_image(new)
+    create_image(other)
+    create_image(Path(pool_dir, "lcitool-golden-fedora-32.qcow2"))
+
+    removed = golden.prune(pool_dir, {"lcitool-golden-fedora-32": {new}})
+
+    assert removed == []
+
+
+def test_prune_removes_nothing_on_failure(env):
+    pool_dir, create_image, define_guest = env
+
+    old = golden_path(pool_dir, "a")
+    new = golden_path(pool_dir, "b")
+    create_image(old)
+    create_image(new)
+    # A guest whose disks can't be looked up might be using any image
+    define_guest("broken", None, "<domain")
+
+    removed = golden.prune(pool_dir, {"lcitool-golden-fedora-32": {new}})
+
+    assert removed == []
+    assert old.exists()
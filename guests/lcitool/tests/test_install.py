@@ -0,0 +1,171 @@
+# test_install.py - module containing tests for the install command
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from lcitool.application import Application
+from lcitool.commandline import CommandLine
+
+# The stand-in for virt-install defines guests as files in
+# $FAKE_VIRT_INSTALL_DIR, and fails to install the ones listed in
+# $FAKE_VIRT_INSTALL_FAIL after defining them
+FAKE_VIRT_INSTALL = """\
+import os, sys
+from pathlib import Path
+
+if sys.argv[1] == "--version":
+    print("2.2.1")
+    sys.exit(0)
+
+name = sys.argv[sys.argv.index("--name") + 1]
+print("Installing", name)
+guest = Path(os.environ["FAKE_VIRT_INSTALL_DIR"], name)
+guest.write_text("defined")
+
+if name in os.environ["FAKE_VIRT_INSTALL_FAIL"].split(","):
+    print("Something went wrong")
+    sys.exit(1)
+
+guest.write_text("installed")
+"""
+
+HOSTS = ["libvirt-debian-10", "libvirt-fedora-32", "libvirt-ubuntu-1804"]
+
+
+@pytest.fixture
+def installed(tmp_path, monkeypatch):
+    bin_dir = Path(tmp_path, "bin")
+    bin_dir.mkdir()
+    virt_install = Path(bin_dir, "virt-install")
+    virt_install.write_text("#!{}\n{}".format(sys.executable,
+                                              FAKE_VIRT_INSTALL))
+    virt_install.chmod(0o755)
+
+    config_dir = Path(tmp_path, "config", "lcitool")
+    config_dir.mkdir(parents=True)
+    Path(config_dir, "config.yaml").write_text(
+        "install:\n  root_password: secret\n")
+
+    installed_dir = Path(tmp_path, "installed")
+    installed_dir.mkdir()
+
+    monkeypatch.setenv("PATH", bin_dir.as_posix() + os.pathsep +
+                       os.environ["PATH"])
+    monkeypatch.setenv("XDG_CONFIG_HOME", Path(tmp_path, "config").as_posix())
+    monkeypatch.setenv("XDG_CACHE_HOME", Path(tmp_path, "cache").as_posix())
+    monkeypatch.setenv("FAKE_VIRT_INSTALL_DIR", installed_dir.as_posix())
+    monkeypatch.setenv("FAKE_VIRT_INSTALL_FAIL",
+                       "libvirt-fedora-32,lcitool-golden-fedora-32-0123456789ab")
+
+    return installed_dir
+
+
+def install(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["lcitool", "install"] + list(args))
+    Application().run(CommandLine().parse())
+
+
+@pytest.mark.parametrize("parallel", ["1", "3"])
+def test_install_failure(installed, monkeypatch, capsys, parallel):
+    with pytest.raises(Exception, match="Failed to install 1 out of 3"):
+        install(monkeypatch, "-j", parallel, ",".join(HOSTS))
+
+    # A failing installation doesn't prevent the others from happening
+    assert sorted(p.name for p in installed.iterdir()
+                  if p.read_text() == "installed") == [
+        "libvirt-debian-10",
+        "libvirt-ubuntu-1804",
+    ]
+
+    out = capsys.readouterr().out
+    assert "libvirt-debian-10: OK" in out
+    assert "libvirt-fedora-32: FAILED" in out
+    assert "libvirt-ubuntu-1804: OK" in out
+
+
+def test_install_parallel_logs(installed, monkeypatch, capsys):
+    install(monkeypatch, "-j", "2", "libvirt-debian-10,libvirt-ubuntu-1804")
+
+    logs = Path(os.environ["XDG_CACHE_HOME"], "lcitool", "logs", "install")
+    log = Path(logs, "libvirt-debian-10.log").read_text()
+    assert "[libvirt-debian-10 virt-install] Installing libvirt-debian-10" in log
+
+
+# The stand-ins for the commands used with golden images keep track of
+# the guests that have been defined as files in $FAKE_VIRT_INSTALL_DIR
+FAKE_VIRSH = """\
+import os, sys
+from pathlib import Path
+
+args = [a for a in sys.argv[1:] if a != "-q"]
+guest = Path(os.environ["FAKE_VIRT_INSTALL_DIR"], args[-1])
+
+if args[0] == "dominfo":
+    sys.exit(0 if guest.exists() else 1)
+elif args[0] == "destroy":
+    sys.exit(1)
+elif args[0] == "undefine":
+    guest.unlink()
+else:
+    sys.exit(1)
+"""
+
+FAKE_QEMU_IMG = """\
+import sys
+from pathlib import Path
+
+Path(sys.argv[-1]).write_text("overlay")
+"""
+
+FAKE_VIRT_CUSTOMIZE = """\
+import sys
+
+sys.exit(1)
+"""
+
+
+@pytest.fixture
+def golden_tools(installed, tmp_path):
+    bin_dir = Path(tmp_path, "bin")
+    for name, source in [("virsh", FAKE_VIRSH),
+                         ("qemu-img", FAKE_QEMU_IMG),
+                         ("virt-customize", FAKE_VIRT_CUSTOMIZE)]:
+        path = Path(bin_dir, name)
+        path.write_text("#!{}\n{}".format(sys.executable, source))
+        path.chmod(0o755)
+
+    pool_dir = Path(tmp_path, "pool")
+    pool_dir.mkdir()
+    return installed, pool_dir
+
+
+def test_build_golden_failure(golden_tools):
+    installed, pool_dir = golden_tools
+    path = Path(pool_dir, "lcitool-golden-fedora-32-0123456789ab.qcow2")
+
+    with pytest.raises(Exception, match="Failed to build golden image"):
+        Application()._build_golden("libvirt-fedora-32", path, None)
+
+    # The guest has been defined before the installation failed
+
+    assert list(installed.iterdir()) == []
+    assert list(pool_dir.iterdir()) == []
+
+
+def test_clone_host_failure(golden_tools):
+    installed, pool_dir = golden_tools
+    image = Path(pool_dir, "lcitool-golden-fedora-32-0123456789ab.qcow2")
+    image.write_text("")
+
+    with pytest.raises(Exception, match="Failed to clone"):
+        Application()._clone_host("libvirt-fedora-32", image, False, None)
+
+    # The overlay has been created, but virt-customize failed on it
+    assert list(pool_dir.iterdir()) == [image]
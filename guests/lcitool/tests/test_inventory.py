@@ -0,0 +1,84 @@
+# test_inventory.py - module containing tests for the inventory handling
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from pathlib import Path
+
+import pytest
+
+from lcitool import cache
+from lcitool.inventory import Inventory
+
+HOSTS = ["first", "second", "third"]
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", Path(tmp_path, "cache").as_posix())
+
+    ansible = Path(tmp_path, "ansible")
+    Path(ansible, "group_vars", "all").mkdir(parents=True)
+    Path(ansible, "ansible.cfg").write_text(
+        "[defaults]\ninventory = ./inventory\n")
+    Path(ansible, "inventory").write_text("\n".join(HOSTS) + "\n")
+    Path(ansible, "group_vars", "all", "main.yml").write_text(
+        "os: Linux\n")
+    for host in HOSTS:
+        Path(ansible, "host_vars", host).mkdir(parents=True)
+        Path(ansible, "host_vars", host, "main.yml").write_text(
+            "name: {}\n".format(host))
+
+    return tmp_path
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    paths = []
+    load_yaml = cache.load_yaml
+
+    def record(path):
+        paths.append(Path(path).relative_to(Path(path).parents[2]).as_posix())
+        return load_yaml(path)
+
+    monkeypatch.setattr(cache, "load_yaml", record)
+    return paths
+
+
+def snapshots():
+    artifacts = Path(cache.get_cache_dir(), "artifacts")
+    return list(artifacts.glob("inventory-*")) if artifacts.exists() else []
+
+
+def test_facts_loaded_per_host(base, loaded):
+    inventory = Inventory(base)
+
+    facts = inventory.get_facts("second")
+
+    assert facts == {"os": "Linux", "name": "second",
+                     "inventory_hostname": "second"}
+    # Without a snapshot, only the facts for the host are loaded
+    assert loaded == ["group_vars/all/main.yml",
+                      "host_vars/second/main.yml"]
+    assert snapshots() == []
+
+
+def test_snapshot_written_once_all_loaded(base, loaded):
+    inventory = Inventory(base)
+    for host in HOSTS:
+        inventory.get_facts(host)
+    assert len(snapshots()) == 1
+
+    del loaded[:]
+    inventory = Inventory(base)
+    assert inventory.get_facts("third")["name"] == "third"
+    assert loaded == []
+
+    # Changing any of the source files invalidates the snapshot
+    Path(base, "ansible", "host_vars", "first", "extra.yml").write_text(
+        "extra: true\n")
+    inventory = Inventory(base)
+    assert "extra" not in inventory.get_facts("third")
+    assert inventory.get_facts("first")["extra"] is True
+    assert "host_vars/third/main.yml" in loaded
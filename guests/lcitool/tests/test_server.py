@@ -0,0 +1,52 @@
+# test_server.py - module containing tests for the lcitool server
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from pathlib import Path
+
+import pytest
+
+from lcitool.server import Server
+
+HOSTS = "libvirt-debian-10,libvirt-fedora-32"
+SKIPPED = [
+    "Skipping libvirt-fedora-32 (cross aarch64): "
+    "Cannot cross compile for aarch64 on Fedora",
+]
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", Path(tmp_path, "cache").as_posix())
+    return Server()
+
+
+def test_batch_skipped(server, capsys):
+    response = server.handle({"action": "dockerfile", "hosts": HOSTS,
+                              "projects": "libvirt", "cross_arch": "aarch64",
+                              "batch": True})
+
+    assert sorted(response["files"]) == [
+        "libvirt-debian-10-libvirt",
+        "libvirt-debian-10-libvirt-cross-aarch64",
+        "libvirt-fedora-32-libvirt",
+    ]
+    # Messages are meant for the client, not for whoever runs the server
+    assert response["skipped"] == SKIPPED
+    assert capsys.readouterr().err == ""
+
+
+def test_variables_skipped(server, capsys):
+    response = server.handle({"action": "variables", "hosts": HOSTS,
+                              "projects": "libvirt", "cross_arch": "aarch64",
+                              "format": "json"})
+
+    assert response["skipped"] == SKIPPED
+    assert capsys.readouterr().err == ""
+
+    response = server.handle({"action": "variables",
+                              "hosts": "libvirt-debian-10",
+                              "projects": "libvirt"})
+    assert response["skipped"] == []
@@ -0,0 +1,71 @@
+# test_snapshot.py - module containing tests for the package snapshots
+#
+# Copyright (C) 2017-2020 Red Hat, Inc.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import io
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from lcitool import snapshot
+
+
+def make_archive(*members):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        for name, kind, target in members:
+            info = tarfile.TarInfo(name)
+            info.type = kind
+            info.linkname = target or ""
+            content = b"content" if kind == tarfile.REGTYPE else b""
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    data.seek(0)
+    return tarfile.open(fileobj=data)
+
+
+@pytest.fixture(params=["filter", "fallback"])
+def extract(request, monkeypatch, tmp_path):
+    if request.param == "filter":
+        if not hasattr(tarfile, "data_filter"):
+            pytest.skip("tarfile extraction filters not available")
+    else:
+        monkeypatch.delattr(tarfile, "data_filter", raising=False)
+
+    dest = Path(tmp_path, "dest")
+
+    def extract(*members):
+        with make_archive(*members) as tar:
+            snapshot._extract(tar, dest)
+        return dest
+
+    return extract
+
+
+def test_extract(extract):
+    dest = extract(("vars", tarfile.DIRTYPE, None),
+                   ("vars/main.yml", tarfile.REGTYPE, None),
+                   ("vars/link.yml", tarfile.SYMTYPE, "main.yml"))
+
+    assert Path(dest, "vars", "link.yml").read_bytes() == b"content"
+
+
+@pytest.mark.parametrize("member", [
+    ("../outside", tarfile.REGTYPE, None),
+    ("/outside", tarfile.REGTYPE, None),
+    ("vars/link", tarfile.SYMTYPE, "../../outside"),
+    ("vars/link", tarfile.SYMTYPE, "/outside"),
+    ("vars/link", tarfile.LNKTYPE, "../outside"),
+])
+def test_extract_outside(extract, tmp_path, member):
+    try:
+        extract(member)
+    except Exception:
+        pass
+
+    assert not Path(tmp_path, "outside").exists()
+    assert not Path("/outside").exists()
+    assert not list(Path(tmp_path).glob("dest/**/link"))